@@ -5,18 +5,36 @@ Provides JWT-based authentication with email/password and Google Sign-In support
 """
 
 import os
+import base64
+import hashlib
+import hmac
+import json
 import logging
-from datetime import datetime, timedelta, timezone
+import secrets
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from typing import Optional
 
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel, Field, EmailStr
-from jose import JWTError, jwt
+from pydantic import BaseModel, ConfigDict, Field, EmailStr, computed_field, field_validator
+import jwt
+from jwt.exceptions import (
+    DecodeError,
+    ExpiredSignatureError,
+    InvalidSignatureError,
+    InvalidTokenError,
+    MissingRequiredClaimError,
+)
 import bcrypt
+from cachetools import TTLCache
 
 # Google Auth
-from google.oauth2 import id_token
+from google.auth import jwt as google_jwt
+from google.auth.exceptions import TransportError
 from google.auth.transport import requests as google_requests
 
 logger = logging.getLogger(__name__)
@@ -27,14 +45,75 @@ logger = logging.getLogger(__name__)
 
 # JWT Settings - Use environment variable in production
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "dev-secret-key-change-in-production")
+_SECRET_KEY_BYTES = SECRET_KEY.encode('utf-8')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
+_ACCESS_TOKEN_TTL_SECONDS = ACCESS_TOKEN_EXPIRE_HOURS * 3600
+
+# bcrypt cost factor (2^cost rounds). Tune per deployment so a single hash
+# takes ~250ms on the target hardware; lower values trade security for latency.
+BCRYPT_COST = int(os.environ.get("BCRYPT_COST", "12"))
+if not 4 <= BCRYPT_COST <= 16:
+    raise RuntimeError(f"BCRYPT_COST must be between 4 and 16, got {BCRYPT_COST}")
+
+# Password hash scheme for new hashes: "bcrypt" (default) or "argon2".
+# Existing hashes of either kind keep verifying; with argon2 selected, legacy
+# bcrypt hashes are upgraded on the user's next successful login.
+PASSWORD_HASH = os.environ.get("PASSWORD_HASH", "bcrypt").lower()
+if PASSWORD_HASH not in ("bcrypt", "argon2"):
+    raise RuntimeError(f"PASSWORD_HASH must be 'bcrypt' or 'argon2', got {PASSWORD_HASH!r}")
+
+# Argon2id is optional - only needed when selected or when argon2 hashes exist
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import InvalidHashError, VerificationError
+    _argon2_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+except ImportError:
+    _argon2_hasher = None
+    if PASSWORD_HASH == "argon2":
+        raise RuntimeError("PASSWORD_HASH=argon2 requires the argon2-cffi package")
+
+# Passwords outside these bounds are rejected before any hashing work;
+# bcrypt only considers the first 72 bytes anyway
+MIN_PASSWORD_LENGTH = 6
+MAX_PASSWORD_BYTES = 72
+
+# Per-client token bucket in front of the password endpoints. Buckets live in
+# each worker process, so the effective limit is this x workers x instances.
+AUTH_RATE_LIMIT_PER_MINUTE = int(os.environ.get("AUTH_RATE_LIMIT_PER_MINUTE", "10"))
+
+# Proxies in front of the app that append to X-Forwarded-For: 1 for Cloud Run's
+# front end, 2 behind a Google HTTPS load balancer (it appends the client and
+# its own address), 0 to use the socket peer address only.
+TRUSTED_PROXY_HOPS = int(os.environ.get("TRUSTED_PROXY_HOPS", "1"))
+
+# Verified JWT payloads are cached briefly so repeat requests with the same
+# token skip signature verification; only expiry is re-checked on a hit.
+# The cache is per worker process.
+TOKEN_CACHE_MAXSIZE = 10_000
+TOKEN_CACHE_TTL_SECONDS = 60
 
 # Google OAuth - Client ID from Google Cloud Console
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_CLIENT_ID", "")
 
+# Google's ID token signing certs ({kid: PEM}), cached in-process and
+# refreshed periodically (or early when an unknown key ID shows up)
+GOOGLE_CERTS_URL = "https://www.googleapis.com/oauth2/v1/certs"
+GOOGLE_CERTS_REFRESH_SECONDS = 6 * 3600
+GOOGLE_CERTS_MIN_REFRESH_SECONDS = 60
+
+# Keyed lookup collections so email/Google ID logins are a single document get
+EMAIL_INDEX_COLLECTION = "auth_users_by_email"
+GOOGLE_INDEX_COLLECTION = "auth_users_by_google"
+
+# Only during the index rollout: on an index miss, also query the users
+# collection for records written by the previous release (see
+# migrate_auth_indexes.py). Off otherwise, so a miss stays a single get.
+AUTH_INDEX_FALLBACK = os.environ.get("AUTH_INDEX_FALLBACK", "false").lower() == "true"
+
 # Bearer token security scheme
 security = HTTPBearer()
+_UNAUTH_HEADERS = {"WWW-Authenticate": "Bearer"}
 
 
 # =============================================================================
@@ -43,6 +122,8 @@ security = HTTPBearer()
 
 class UserAuth(BaseModel):
     """User authentication record stored in Firestore."""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     user_id: str
     email: str
     password_hash: Optional[str] = None  # None for Google-only users
@@ -50,34 +131,20 @@ class UserAuth(BaseModel):
     is_onboarded: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     
+    @computed_field
+    @property
+    def email_lc(self) -> str:
+        """Canonical lowercased email used for lookups."""
+        return self.email.lower()
+    
     def to_firestore_dict(self) -> dict:
         """Convert to Firestore-compatible dictionary."""
-        return {
-            "user_id": self.user_id,
-            "email": self.email,
-            "password_hash": self.password_hash,
-            "google_id": self.google_id,
-            "is_onboarded": self.is_onboarded,
-            "created_at": self.created_at.isoformat(),
-        }
+        return self.model_dump(mode='json')
     
     @classmethod
     def from_firestore_dict(cls, data: dict) -> "UserAuth":
         """Create from Firestore document."""
-        created_at = data.get("created_at")
-        if isinstance(created_at, str):
-            created_at = datetime.fromisoformat(created_at)
-        elif created_at is None:
-            created_at = datetime.now(timezone.utc)
-            
-        return cls(
-            user_id=data["user_id"],
-            email=data["email"],
-            password_hash=data.get("password_hash"),
-            google_id=data.get("google_id"),
-            is_onboarded=data.get("is_onboarded", False),
-            created_at=created_at,
-        )
+        return cls.model_validate(data)
 
 
 class Token(BaseModel):
@@ -92,7 +159,15 @@ class Token(BaseModel):
 class SignupRequest(BaseModel):
     """Email/password signup request."""
     email: EmailStr
-    password: str = Field(..., min_length=6)
+    password: str = Field(..., min_length=MIN_PASSWORD_LENGTH)
+    
+    @field_validator("password")
+    @classmethod
+    def password_fits_hash(cls, value: str) -> str:
+        """Reject passwords the hasher would silently truncate."""
+        if len(value.encode('utf-8')) > MAX_PASSWORD_BYTES:
+            raise ValueError(f"Password must be at most {MAX_PASSWORD_BYTES} bytes")
+        return value
 
 
 class LoginRequest(BaseModel):
@@ -113,55 +188,214 @@ class UserResponse(BaseModel):
     is_onboarded: bool
 
 
+# =============================================================================
+# Lookup Keys
+# =============================================================================
+
+def email_key(email: str) -> str:
+    """Document ID for an email in the email index collection."""
+    return hashlib.sha256(email.lower().encode('utf-8')).hexdigest()
+
+
 # =============================================================================
 # Password Utilities
 # =============================================================================
 
 def hash_password(password: str) -> str:
-    """Hash a password using bcrypt."""
+    """Hash a password using the configured scheme (bcrypt or argon2id)."""
+    if PASSWORD_HASH == "argon2":
+        return _argon2_hasher.hash(password)
+    
     password_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=BCRYPT_COST)
     hashed = bcrypt.hashpw(password_bytes, salt)
     return hashed.decode('utf-8')
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
+    """Verify a password against its hash, whichever scheme produced it."""
+    if hashed_password.startswith("$argon2"):
+        if _argon2_hasher is None:
+            logger.error("Found an argon2 password hash but argon2-cffi is not installed")
+            return False
+        try:
+            return _argon2_hasher.verify(hashed_password, plain_password)
+        except (VerificationError, InvalidHashError):
+            return False
+    
     password_bytes = plain_password.encode('utf-8')
     hashed_bytes = hashed_password.encode('utf-8')
     return bcrypt.checkpw(password_bytes, hashed_bytes)
 
 
+def password_in_bounds(password: str) -> bool:
+    """Cheap length check to run before any password hashing."""
+    return (
+        len(password) >= MIN_PASSWORD_LENGTH
+        and len(password.encode('utf-8')) <= MAX_PASSWORD_BYTES
+    )
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """Whether a verified hash should be replaced with one from the configured scheme."""
+    if PASSWORD_HASH != "argon2":
+        return False
+    if not hashed_password.startswith("$argon2"):
+        return True
+    return _argon2_hasher.check_needs_rehash(hashed_password)
+
+
+def log_password_hash_config() -> None:
+    """Log the active password hash scheme (called at startup, once logging is set up)."""
+    if PASSWORD_HASH == "argon2":
+        logger.info("Password hashing configured with argon2id")
+    else:
+        logger.info(f"Password hashing configured with bcrypt cost {BCRYPT_COST}")
+
+
+# Verified against when a login names an unknown user, so that path costs the
+# same as a wrong password and doesn't reveal which emails are registered
+_DUMMY_PASSWORD_HASH = hash_password(secrets.token_urlsafe(16))
+
+
+# =============================================================================
+# Rate Limiting
+# =============================================================================
+
+_rate_buckets: TTLCache = TTLCache(maxsize=10000, ttl=60)
+_rate_buckets_lock = threading.Lock()
+
+
+def _client_ip(request: Request) -> str:
+    """
+    Client address for rate limiting.
+    
+    Takes the X-Forwarded-For entry added by the outermost trusted proxy
+    (TRUSTED_PROXY_HOPS from the right); entries to its left are
+    client-supplied and can be spoofed.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if TRUSTED_PROXY_HOPS and forwarded:
+        entries = forwarded.split(",")
+        return entries[-min(TRUSTED_PROXY_HOPS, len(entries))].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def auth_rate_limit(request: Request) -> None:
+    """
+    FastAPI dependency that throttles password endpoints per client IP.
+    
+    Each client gets a token bucket of AUTH_RATE_LIMIT_PER_MINUTE requests,
+    refilled continuously over a minute. Buckets are per worker process, so
+    across a deployment the real limit is that times workers times instances.
+    """
+    capacity = AUTH_RATE_LIMIT_PER_MINUTE
+    ip = _client_ip(request)
+    now = time.monotonic()
+    
+    with _rate_buckets_lock:
+        tokens, last = _rate_buckets.get(ip, (capacity, now))
+        tokens = min(capacity, tokens + (now - last) * capacity / 60)
+        allowed = tokens >= 1
+        _rate_buckets[ip] = (tokens - 1 if allowed else tokens, now)
+    
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many attempts, please try again later",
+        )
+
+
 # =============================================================================
 # JWT Utilities
 # =============================================================================
 
 def create_access_token(user_id: str, email: str, is_onboarded: bool) -> str:
     """Create a JWT access token."""
-    expire = datetime.now(timezone.utc) + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
+    now = int(time.time())
     
     payload = {
         "sub": user_id,
         "email": email,
         "is_onboarded": is_onboarded,
-        "exp": expire,
-        "iat": datetime.now(timezone.utc),
+        "exp": now + _ACCESS_TOKEN_TTL_SECONDS,
+        "iat": now,
     }
     
-    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(payload, _SECRET_KEY_BYTES, algorithm=ALGORITHM)
+
+
+_token_cache: TTLCache = TTLCache(maxsize=TOKEN_CACHE_MAXSIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+_token_cache_lock = threading.Lock()
+
+
+def _token_cache_key(token: str) -> bytes:
+    """Fixed-size cache key so long tokens don't bloat the cache."""
+    return hashlib.blake2b(token.encode('utf-8'), digest_size=16).digest()
+
+
+def _b64url_decode(segment: str) -> bytes:
+    """Decode an unpadded base64url JWT segment."""
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _fast_decode_hs256(token: str) -> dict:
+    """
+    Verify and decode an HS256 token with a single split and one HMAC.
+    
+    Only the payload segment is decoded; the signature over the header is
+    authoritative, so the header itself never needs parsing.
+    """
+    signing_input, _, sig_b64 = token.rpartition(".")
+    _, _, payload_b64 = signing_input.partition(".")
+    if not payload_b64 or "." in payload_b64:
+        raise DecodeError("Not enough segments")
+    
+    try:
+        signature = _b64url_decode(sig_b64)
+        expected = hmac.new(
+            _SECRET_KEY_BYTES, signing_input.encode('ascii'), hashlib.sha256
+        ).digest()
+        if not hmac.compare_digest(signature, expected):
+            raise InvalidSignatureError("Signature verification failed")
+        payload = json.loads(_b64url_decode(payload_b64))
+    except ValueError as e:
+        raise DecodeError(f"Invalid token: {e}") from e
+    
+    if not isinstance(payload, dict) or not isinstance(payload.get("exp"), (int, float)):
+        raise MissingRequiredClaimError("exp")
+    if payload["exp"] <= time.time():
+        raise ExpiredSignatureError("Signature has expired")
+    
+    return payload
 
 
 def decode_token(token: str) -> dict:
     """Decode and validate a JWT token."""
+    key = _token_cache_key(token)
+    with _token_cache_lock:
+        payload = _token_cache.get(key)
+    
+    if payload is not None:
+        if payload["exp"] > time.time():
+            return payload
+        with _token_cache_lock:
+            _token_cache.pop(key, None)
+    
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if ALGORITHM == "HS256":
+            payload = _fast_decode_hs256(token)
+        else:
+            payload = jwt.decode(token, _SECRET_KEY_BYTES, algorithms=[ALGORITHM])
+        with _token_cache_lock:
+            _token_cache[key] = payload
         return payload
-    except JWTError as e:
+    except InvalidTokenError as e:
         logger.warning(f"JWT decode error: {e}")
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid or expired token",
-            headers={"WWW-Authenticate": "Bearer"},
+            headers=_UNAUTH_HEADERS,
         )
 
 
@@ -169,6 +403,62 @@ def decode_token(token: str) -> dict:
 # Google OAuth Utilities
 # =============================================================================
 
+_google_request = google_requests.Request()
+_google_certs: dict[str, str] = {}
+_google_certs_fetched_at = 0.0
+# Single-flight guard: held for the whole fetch, so concurrent logins that find
+# the cache stale wait for one refresh instead of each refetching
+_google_certs_lock = threading.Lock()
+
+
+def _fetch_google_certs() -> None:
+    """Fetch Google's certs into the cache; callers must hold _google_certs_lock."""
+    global _google_certs, _google_certs_fetched_at
+    
+    response = _google_request(GOOGLE_CERTS_URL, method="GET")
+    if response.status != 200:
+        raise TransportError(f"Could not fetch Google certs (HTTP {response.status})")
+    
+    certs = json.loads(response.data.decode('utf-8'))
+    _google_certs = certs
+    _google_certs_fetched_at = time.monotonic()
+    logger.info(f"Refreshed {len(certs)} Google signing certs")
+
+
+def refresh_google_certs() -> None:
+    """Fetch Google's current ID token signing certs into the local cache."""
+    with _google_certs_lock:
+        _fetch_google_certs()
+
+
+def _google_certs_need_refresh(kid: Optional[str]) -> bool:
+    """Whether the cache is stale or lacks the token's key ID (after a short grace period)."""
+    age = time.monotonic() - _google_certs_fetched_at
+    stale = not _google_certs or age > GOOGLE_CERTS_REFRESH_SECONDS
+    rotated = kid not in _google_certs and age > GOOGLE_CERTS_MIN_REFRESH_SECONDS
+    return stale or rotated
+
+
+def _get_google_certs(kid: Optional[str]) -> dict[str, str]:
+    """Return cached Google certs, refetching when stale or missing the key ID."""
+    if _google_certs_need_refresh(kid):
+        with _google_certs_lock:
+            # Another thread may have refreshed while this one waited
+            if _google_certs_need_refresh(kid):
+                _fetch_google_certs()
+    
+    return _google_certs
+
+
+def _unverified_kid(token: str) -> Optional[str]:
+    """Read the key ID from a JWT header without verifying the token."""
+    try:
+        header = json.loads(_b64url_decode(token.partition(".")[0]))
+    except ValueError:
+        return None
+    return header.get("kid") if isinstance(header, dict) else None
+
+
 def verify_google_token(credential: str) -> dict:
     """
     Verify a Google ID token and return the user info.
@@ -188,10 +478,10 @@ def verify_google_token(credential: str) -> dict:
         )
     
     try:
-        idinfo = id_token.verify_oauth2_token(
+        idinfo = google_jwt.decode(
             credential,
-            google_requests.Request(),
-            GOOGLE_CLIENT_ID
+            certs=_get_google_certs(_unverified_kid(credential)),
+            audience=GOOGLE_CLIENT_ID,
         )
         
         # Verify issuer
@@ -244,34 +534,67 @@ class AuthService:
     Authentication service for managing users in Firestore.
     """
     
-    def __init__(self, db, collection_name: str = "auth_users"):
+    def __init__(
+        self,
+        db,
+        collection_name: str = "auth_users",
+        email_index_collection: str = EMAIL_INDEX_COLLECTION,
+        google_index_collection: str = GOOGLE_INDEX_COLLECTION,
+    ):
         """
         Initialize the auth service.
         
         Args:
             db: Firestore client instance
             collection_name: Collection name for auth users
+            email_index_collection: Collection mapping email keys to user IDs
+            google_index_collection: Collection mapping Google IDs to user IDs
         """
         self.db = db
         self.collection = db.collection(collection_name)
+        self.email_index = db.collection(email_index_collection)
+        self.google_index = db.collection(google_index_collection)
     
-    def get_user_by_email(self, email: str) -> Optional[UserAuth]:
-        """Get user by email address."""
-        docs = self.collection.where("email", "==", email).limit(1).stream()
+    def _get_indexed_user(self, index_doc_ref, legacy_filters: tuple[tuple[str, str], ...]) -> Optional[UserAuth]:
+        """
+        Resolve a secondary index document to its user record.
         
-        for doc in docs:
-            return UserAuth.from_firestore_dict(doc.to_dict())
+        With AUTH_INDEX_FALLBACK set, an index miss falls back to querying
+        the users collection with each (field, value) in legacy_filters and
+        writes the missing index entry. This covers users created by the
+        previous release after migrate_auth_indexes.py ran.
+        """
+        doc = index_doc_ref.get()
+        
+        if doc.exists:
+            return self.get_user_by_id(doc.to_dict()["user_id"])
+        
+        if not AUTH_INDEX_FALLBACK:
+            return None
+        
+        for field, value in legacy_filters:
+            for doc in self.collection.where(field, "==", value).limit(1).stream():
+                user = UserAuth.from_firestore_dict(doc.to_dict())
+                logger.info(f"Backfilling {field} index entry for user {user.user_id}")
+                index_doc_ref.set({"user_id": user.user_id})
+                return user
         
         return None
     
+    def get_user_by_email(self, email: str) -> Optional[UserAuth]:
+        """Get user by email address (case-insensitive)."""
+        # Records written before email_lc existed only match on the email as typed
+        return self._get_indexed_user(
+            self.email_index.document(email_key(email)),
+            (("email_lc", email.lower()), ("email", email)),
+        )
+    
     def get_user_by_google_id(self, google_id: str) -> Optional[UserAuth]:
         """Get user by Google ID."""
-        docs = self.collection.where("google_id", "==", google_id).limit(1).stream()
-        
-        for doc in docs:
-            return UserAuth.from_firestore_dict(doc.to_dict())
-        
-        return None
+        return self._get_indexed_user(
+            self.google_index.document(google_id),
+            (("google_id", google_id),),
+        )
     
     def get_user_by_id(self, user_id: str) -> Optional[UserAuth]:
         """Get user by user ID."""
@@ -282,28 +605,41 @@ class AuthService:
         
         return None
     
+    def _set_index_entries(self, batch, user: UserAuth) -> None:
+        """Add the user's email/Google ID index writes to a batch."""
+        index_entry = {"user_id": user.user_id}
+        batch.set(self.email_index.document(email_key(user.email)), index_entry)
+        if user.google_id:
+            batch.set(self.google_index.document(user.google_id), index_entry)
+    
     def create_user(self, user: UserAuth) -> UserAuth:
-        """Create a new user."""
-        self.collection.document(user.user_id).set(user.to_firestore_dict())
+        """Create a new user along with its email/Google ID index entries."""
+        batch = self.db.batch()
+        batch.set(self.collection.document(user.user_id), user.to_firestore_dict())
+        self._set_index_entries(batch, user)
+        batch.commit()
         return user
     
     def update_user(self, user: UserAuth) -> UserAuth:
-        """Update an existing user."""
-        self.collection.document(user.user_id).update(user.to_firestore_dict())
+        """Update an existing user, keeping its index entries in the same commit."""
+        batch = self.db.batch()
+        batch.update(self.collection.document(user.user_id), user.to_firestore_dict())
+        self._set_index_entries(batch, user)
+        batch.commit()
         return user
     
     def set_onboarded(self, user_id: str) -> None:
         """Mark a user as onboarded."""
         self.collection.document(user_id).update({"is_onboarded": True})
     
-    def signup_with_email(self, email: str, password: str) -> Token:
+    async def signup_with_email(self, email: str, password: str) -> Token:
         """
         Create a new user with email/password.
         
         Raises HTTPException if email already exists.
         """
         # Check if user exists
-        existing = self.get_user_by_email(email)
+        existing = await run_in_threadpool(self.get_user_by_email, email)
         if existing:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -311,17 +647,16 @@ class AuthService:
             )
         
         # Create user
-        import uuid
-        user_id = f"user_{uuid.uuid4().hex[:12]}"
+        user_id = f"user_{secrets.token_hex(6)}"
         
         user = UserAuth(
             user_id=user_id,
             email=email,
-            password_hash=hash_password(password),
+            password_hash=await run_in_threadpool(hash_password, password),
             is_onboarded=False,
         )
         
-        self.create_user(user)
+        await run_in_threadpool(self.create_user, user)
         
         # Generate token
         access_token = create_access_token(user.user_id, user.email, user.is_onboarded)
@@ -333,26 +668,49 @@ class AuthService:
             is_onboarded=user.is_onboarded,
         )
     
-    def login_with_email(self, email: str, password: str) -> Token:
+    async def _rehash_password(self, user: UserAuth, password: str) -> None:
+        """Upgrade a legacy password hash in place after a successful login."""
+        try:
+            new_hash = await run_in_threadpool(hash_password, password)
+            await run_in_threadpool(
+                self.update_user, user.model_copy(update={"password_hash": new_hash})
+            )
+            logger.info(f"Upgraded password hash for user {user.user_id}")
+        except Exception as e:
+            # Login already succeeded; the upgrade can happen next time
+            logger.warning(f"Failed to upgrade password hash for {user.user_id}: {e}")
+    
+    async def login_with_email(self, email: str, password: str) -> Token:
         """
         Authenticate with email/password.
         
         Raises HTTPException if credentials are invalid.
         """
-        user = self.get_user_by_email(email)
+        if not password_in_bounds(password):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid email or password"
+            )
+        
+        user = await run_in_threadpool(self.get_user_by_email, email)
         
         if not user or not user.password_hash:
+            # Burn the same hashing time as a real check to avoid user enumeration
+            await run_in_threadpool(verify_password, password, _DUMMY_PASSWORD_HASH)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
         
-        if not verify_password(password, user.password_hash):
+        if not await run_in_threadpool(verify_password, password, user.password_hash):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
         
+        if password_needs_rehash(user.password_hash):
+            await self._rehash_password(user, password)
+        
         # Generate token
         access_token = create_access_token(user.user_id, user.email, user.is_onboarded)
         
@@ -363,30 +721,29 @@ class AuthService:
             is_onboarded=user.is_onboarded,
         )
     
-    def auth_with_google(self, credential: str) -> Token:
+    async def auth_with_google(self, credential: str) -> Token:
         """
         Authenticate with Google ID token.
         
         Creates a new user if this is their first login.
         """
         # Verify Google token
-        google_info = verify_google_token(credential)
+        google_info = await run_in_threadpool(verify_google_token, credential)
         
         # Check if user exists by Google ID
-        user = self.get_user_by_google_id(google_info["google_id"])
+        user = await run_in_threadpool(self.get_user_by_google_id, google_info["google_id"])
         
         if not user:
             # Check if email exists (link accounts)
-            user = self.get_user_by_email(google_info["email"])
+            user = await run_in_threadpool(self.get_user_by_email, google_info["email"])
             
             if user:
                 # Link Google account to existing user
-                user.google_id = google_info["google_id"]
-                self.update_user(user)
+                user = user.model_copy(update={"google_id": google_info["google_id"]})
+                await run_in_threadpool(self.update_user, user)
             else:
                 # Create new user
-                import uuid
-                user_id = f"user_{uuid.uuid4().hex[:12]}"
+                user_id = f"user_{secrets.token_hex(6)}"
                 
                 user = UserAuth(
                     user_id=user_id,
@@ -395,7 +752,7 @@ class AuthService:
                     is_onboarded=False,
                 )
                 
-                self.create_user(user)
+                await run_in_threadpool(self.create_user, user)
         
         # Generate token
         access_token = create_access_token(user.user_id, user.email, user.is_onboarded)
@@ -411,6 +768,38 @@ class AuthService:
 # Mock Auth Service
 # =============================================================================
 
+@dataclass(slots=True)
+class _UserRow:
+    """Compact in-memory user record; materialized as UserAuth only when returned."""
+    user_id: str
+    email: str
+    password_hash: Optional[str]
+    google_id: Optional[str]
+    is_onboarded: bool
+    created_at: datetime
+    
+    @classmethod
+    def from_user_auth(cls, user: UserAuth) -> "_UserRow":
+        return cls(
+            user_id=user.user_id,
+            email=user.email,
+            password_hash=user.password_hash,
+            google_id=user.google_id,
+            is_onboarded=user.is_onboarded,
+            created_at=user.created_at,
+        )
+    
+    def to_user_auth(self) -> UserAuth:
+        return UserAuth(
+            user_id=self.user_id,
+            email=self.email,
+            password_hash=self.password_hash,
+            google_id=self.google_id,
+            is_onboarded=self.is_onboarded,
+            created_at=self.created_at,
+        )
+
+
 class MockAuthService:
     """
     In-memory mock authentication service for local testing.
@@ -418,35 +807,54 @@ class MockAuthService:
     
     def __init__(self):
         """Initialize the mock auth service with in-memory storage."""
-        self.users = {}  # {user_id: UserAuth}
+        self.users = {}  # {user_id: _UserRow}
+        self._by_email = {}  # {lowercased email: _UserRow}
+        self._by_google_id = {}  # {google_id: _UserRow}
+        self._indexed_keys = {}  # {user_id: (email_lc, google_id)} as last indexed
         print("MockAuthService initialized with in-memory storage")
     
+    def _index_user(self, user: _UserRow) -> None:
+        """Point the secondary indexes at this user, dropping stale keys."""
+        email_lc = user.email.lower()
+        old_email_lc, old_google_id = self._indexed_keys.get(user.user_id, (None, None))
+        if old_email_lc is not None and old_email_lc != email_lc:
+            self._by_email.pop(old_email_lc, None)
+        if old_google_id is not None and old_google_id != user.google_id:
+            self._by_google_id.pop(old_google_id, None)
+        
+        self._by_email[email_lc] = user
+        if user.google_id:
+            self._by_google_id[user.google_id] = user
+        self._indexed_keys[user.user_id] = (email_lc, user.google_id)
+    
+    def _store(self, row: _UserRow) -> None:
+        """Insert or replace a row and refresh its index entries."""
+        self.users[row.user_id] = row
+        self._index_user(row)
+    
     def get_user_by_email(self, email: str) -> Optional[UserAuth]:
         """Get user by email address."""
-        for user in self.users.values():
-            if user.email == email:
-                return user
-        return None
+        row = self._by_email.get(email.lower())
+        return row.to_user_auth() if row else None
     
     def get_user_by_google_id(self, google_id: str) -> Optional[UserAuth]:
         """Get user by Google ID."""
-        for user in self.users.values():
-            if user.google_id == google_id:
-                return user
-        return None
+        row = self._by_google_id.get(google_id)
+        return row.to_user_auth() if row else None
     
     def get_user_by_id(self, user_id: str) -> Optional[UserAuth]:
         """Get user by user ID."""
-        return self.users.get(user_id)
+        row = self.users.get(user_id)
+        return row.to_user_auth() if row else None
     
     def create_user(self, user: UserAuth) -> UserAuth:
         """Create a new user."""
-        self.users[user.user_id] = user
+        self._store(_UserRow.from_user_auth(user))
         return user
     
     def update_user(self, user: UserAuth) -> UserAuth:
         """Update an existing user."""
-        self.users[user.user_id] = user
+        self._store(_UserRow.from_user_auth(user))
         return user
     
     def set_onboarded(self, user_id: str) -> None:
@@ -454,25 +862,26 @@ class MockAuthService:
         if user_id in self.users:
             self.users[user_id].is_onboarded = True
     
-    def signup_with_email(self, email: str, password: str) -> Token:
+    async def signup_with_email(self, email: str, password: str) -> Token:
         """Create a new user with email/password."""
-        if self.get_user_by_email(email):
+        if email.lower() in self._by_email:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
             )
         
-        import uuid
-        user_id = f"user_{uuid.uuid4().hex[:12]}"
+        user_id = f"user_{secrets.token_hex(6)}"
         
-        user = UserAuth(
+        user = _UserRow(
             user_id=user_id,
             email=email,
-            password_hash=hash_password(password),
+            password_hash=await run_in_threadpool(hash_password, password),
+            google_id=None,
             is_onboarded=False,
+            created_at=datetime.now(timezone.utc),
         )
         
-        self.create_user(user)
+        self._store(user)
         access_token = create_access_token(user.user_id, user.email, user.is_onboarded)
         
         return Token(
@@ -482,22 +891,33 @@ class MockAuthService:
             is_onboarded=user.is_onboarded,
         )
     
-    def login_with_email(self, email: str, password: str) -> Token:
+    async def login_with_email(self, email: str, password: str) -> Token:
         """Authenticate with email/password."""
-        user = self.get_user_by_email(email)
+        if not password_in_bounds(password):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid email or password"
+            )
+        
+        user = self._by_email.get(email.lower())
         
         if not user or not user.password_hash:
+            # Burn the same hashing time as a real check to avoid user enumeration
+            await run_in_threadpool(verify_password, password, _DUMMY_PASSWORD_HASH)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
-            
-        if not verify_password(password, user.password_hash):
+        
+        if not await run_in_threadpool(verify_password, password, user.password_hash):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid email or password"
             )
         
+        if password_needs_rehash(user.password_hash):
+            user.password_hash = await run_in_threadpool(hash_password, password)
+        
         access_token = create_access_token(user.user_id, user.email, user.is_onboarded)
         return Token(
             access_token=access_token,
@@ -506,24 +926,25 @@ class MockAuthService:
             is_onboarded=user.is_onboarded,
         )
     
-    def auth_with_google(self, credential: str) -> Token:
+    async def auth_with_google(self, credential: str) -> Token:
         """Mock Google Auth - accepts any non-empty credential as a user."""
         # Simple mock: treat credential as email if it looks like one, else mock it
         email = "mockuser@example.com"
         if "@" in credential:
             email = credential
             
-        user = self.get_user_by_email(email)
+        user = self._by_email.get(email.lower())
         if not user:
-            import uuid
-            user_id = f"user_{uuid.uuid4().hex[:12]}"
-            user = UserAuth(
+            user_id = f"user_{secrets.token_hex(6)}"
+            user = _UserRow(
                 user_id=user_id,
                 email=email,
+                password_hash=None,
                 google_id="mock_google_id",
-                is_onboarded=False
+                is_onboarded=False,
+                created_at=datetime.now(timezone.utc),
             )
-            self.create_user(user)
+            self._store(user)
             
         access_token = create_access_token(user.user_id, user.email, user.is_onboarded)
         return Token(
@@ -8,14 +8,14 @@ let currentUser = null;
     // Check if authUtils exists
     if (typeof window.authUtils === 'undefined') {
         console.error('authUtils not loaded, redirecting to login');
-        window.location.href = '/login.html';
+        window.location.href = '/ui/login.html';
         return;
     }
 
     // Check if user is authenticated
     if (!window.authUtils.isAuthenticated()) {
         console.log('User not authenticated, redirecting to login');
-        window.location.href = '/login.html';
+        window.location.href = '/ui/login.html';
         return;
     }
 
@@ -25,7 +25,7 @@ let currentUser = null;
     // If already onboarded, redirect to menu
     if (currentUser && currentUser.is_onboarded) {
         console.log('User already onboarded, redirecting to menu');
-        window.location.href = '/menu.html';
+        window.location.href = '/ui/menu.html';
         return;
     }
 
@@ -286,7 +286,7 @@ function showProfileModal(data) {
     if (!menuBtn) {
         menuBtn = document.createElement('a');
         menuBtn.id = 'viewMenuBtn';
-        menuBtn.href = '/menu.html';
+        menuBtn.href = '/ui/menu.html';
         menuBtn.className = 'primary-btn';
         menuBtn.style.textAlign = 'center';
         menuBtn.style.display = 'block';
@@ -138,23 +138,23 @@ function redirectBasedOnStatus(user) {
 
     if (!user) {
         // Not authenticated - go to login
-        if (currentPath !== '/login.html') {
-            window.location.href = '/login.html';
+        if (currentPath !== '/ui/login.html') {
+            window.location.href = '/ui/login.html';
         }
         return;
     }
 
     if (!user.is_onboarded) {
         // Authenticated but not onboarded - go to onboarding
-        if (currentPath !== '/' && currentPath !== '/index.html') {
+        if (currentPath !== '/' && currentPath !== '/ui/' && currentPath !== '/ui/index.html') {
             window.location.href = '/';
         }
         return;
     }
 
     // Fully onboarded - go to menu
-    if (currentPath === '/login.html' || currentPath === '/' || currentPath === '/index.html') {
-        window.location.href = '/menu.html';
+    if (currentPath === '/ui/login.html' || currentPath === '/' || currentPath === '/ui/' || currentPath === '/ui/index.html') {
+        window.location.href = '/ui/menu.html';
     }
 }
 
@@ -165,7 +165,7 @@ function checkAuthAndRedirect() {
 
 function logout() {
     clearToken();
-    window.location.href = '/login.html';
+    window.location.href = '/ui/login.html';
 }
 
 // =============================================================================
@@ -183,7 +183,7 @@ async function handleGoogleSignIn(response) {
 
         // Redirect based on onboarding status
         if (tokenResponse.is_onboarded) {
-            window.location.href = '/menu.html';
+            window.location.href = '/ui/menu.html';
         } else {
             window.location.href = '/';
         }
@@ -264,7 +264,7 @@ if (document.getElementById('authForm')) {
 
             // Redirect based on onboarding status
             if (tokenResponse.is_onboarded) {
-                window.location.href = '/menu.html';
+                window.location.href = '/ui/menu.html';
             } else {
                 window.location.href = '/';
             }
@@ -28,7 +28,7 @@ function initMenu() {
     // Auth check
     if (!window.authUtils || !window.authUtils.isAuthenticated()) {
         console.log("Menu.js: Not authenticated, redirecting...");
-        window.location.href = '/login.html';
+        window.location.href = '/ui/login.html';
         return;
     }
 
@@ -0,0 +1,23 @@
+"""
+Gunicorn Configuration
+
+Runs the FastAPI app under several Uvicorn worker processes so blocking
+SDK calls and CPU-bound work in one worker don't stall the whole instance.
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+worker_class = "uvicorn_worker.UvicornWorker"
+workers = int(os.environ.get("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+
+# Mock mode keeps users and sessions in process memory, so every request has
+# to reach the same worker
+if os.environ.get("MOCK_MODE", "false").lower() == "true":
+    workers = 1
+timeout = 120
+
+# Don't import the app in the master: each worker runs the FastAPI lifespan
+# after fork, so Vertex AI / Firestore clients and their gRPC channels are
+# never shared across processes.
+preload_app = False
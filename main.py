@@ -6,13 +6,21 @@ Designed for deployment on Cloud Run.
 """
 
 import os
-import json
-from datetime import datetime
-from contextlib import asynccontextmanager
+import queue
+import asyncio
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from datetime import datetime, timezone
+from contextlib import asynccontextmanager, suppress
 from typing import Optional
 
-from fastapi import FastAPI, HTTPException, status, Depends
+import anyio.to_thread
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, status, Depends, BackgroundTasks
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel, Field
 
@@ -23,20 +31,29 @@ from auth import (
     LoginRequest,
     GoogleAuthRequest,
     UserResponse,
+    auth_rate_limit,
     get_current_user,
     create_access_token,
+    refresh_google_certs,
+    log_password_hash_config,
+    GOOGLE_CLIENT_ID,
+    GOOGLE_CERTS_REFRESH_SECONDS,
 )
 
 from onboarding_agent import (
     OnboardingConversationHandler,
     UserProfile,
     LocationData,
+    ChatMessage,
 )
+
+logger = logging.getLogger(__name__)
+
 try:
     from menu_generator import MenuGenerator, GeneratedMenuDocument, WeeklyMenu, DailyMenu, MenuSlot
 except ImportError:
     MenuGenerator = None
-    print("Warning: Failed to import MenuGenerator (missing dependencies?)")
+    logger.warning("Failed to import MenuGenerator (missing dependencies?)")
 
 # =============================================================================
 # Mock Generator (Fallback)
@@ -44,16 +61,15 @@ except ImportError:
 class MockMenuGenerator:
     """Fallback generator for local testing/verification without GCP credentials."""
     
+    _CREATED_AT = datetime.now(timezone.utc)
+    
     def __init__(self, project_id, location):
         self.project_id = project_id
-    
-    def get_latest_menu(self, user_id: str):
-        print(f"Using MockMenuGenerator for user {user_id}")
-        # Return a dummy menu
-        return GeneratedMenuDocument(
-            user_id=user_id,
+        # Built once; each call only swaps in the user id
+        self._cached_menu = GeneratedMenuDocument(
+            user_id="",
             week_start_date="2024-01-01",
-            created_at=datetime.utcnow(),
+            created_at=self._CREATED_AT,
             menu=WeeklyMenu(
                 monday=DailyMenu(
                     dinner=MenuSlot(
@@ -79,12 +95,17 @@ class MockMenuGenerator:
             )
         )
     
+    def get_latest_menu(self, user_id: str):
+        logger.info(f"Using MockMenuGenerator for user {user_id}")
+        # Return a dummy menu
+        return self._cached_menu.model_copy(update={"user_id": user_id})
+    
     def generate_menu_for_user(self, user_id: str) -> bool:
         """Mock menu generation - returns True immediately for testing."""
-        print(f"MockMenuGenerator: Generating menu for user {user_id}")
+        logger.info(f"MockMenuGenerator: Generating menu for user {user_id}")
         # In mock mode, get_latest_menu always returns a dummy menu,
         # so we don't need to actually persist anything
-        print(f"MockMenuGenerator: Mock menu ready for user {user_id}")
+        logger.info(f"MockMenuGenerator: Mock menu ready for user {user_id}")
         return True
 
 
@@ -116,6 +137,12 @@ class SendMessageResponse(BaseModel):
     is_complete: bool
 
 
+class ConversationHistoryResponse(BaseModel):
+    """Messages exchanged so far in a conversation."""
+    session_id: str
+    messages: list[ChatMessage]
+
+
 class FinalizeProfileRequest(BaseModel):
     """Request to finalize and save the user profile."""
     session_id: str
@@ -124,7 +151,7 @@ class FinalizeProfileRequest(BaseModel):
 
 class FinalizeProfileResponse(BaseModel):
     """Response with the created user profile."""
-    profile: dict
+    profile: UserProfile
     success: bool
     access_token: Optional[str] = None  # New token with is_onboarded=true
 
@@ -135,6 +162,16 @@ class HealthResponse(BaseModel):
     version: str = "1.0.0"
 
 
+# =============================================================================
+# Configuration
+# =============================================================================
+
+# Read once at import; nothing below touches os.environ at request time
+MOCK_MODE = os.environ.get("MOCK_MODE", "false").lower() == "true"
+GOOGLE_CLOUD_PROJECT = os.environ.get("GOOGLE_CLOUD_PROJECT")
+VERTEX_AI_LOCATION = os.environ.get("VERTEX_AI_LOCATION", "us-central1")
+
+
 # =============================================================================
 # Application Setup
 # =============================================================================
@@ -144,36 +181,109 @@ handler: Optional[OnboardingConversationHandler] = None
 menu_generator: Optional[MenuGenerator] = None
 auth_service: Optional[AuthService] = None
 
+# Per-worker read caches for serialized profiles and menus ({user_id: JSON bytes}).
+# Profiles change rarely and menus weekly; only hits are cached, never misses.
+# Invalidation only reaches the worker that handled the write, so other workers
+# (and instances) may serve a stale copy for up to the TTL.
+PROFILE_CACHE_TTL_SECONDS = 300
+MENU_CACHE_TTL_SECONDS = 3600
+profile_cache: TTLCache = TTLCache(maxsize=4096, ttl=PROFILE_CACHE_TTL_SECONDS)
+menu_cache: TTLCache = TTLCache(maxsize=4096, ttl=MENU_CACHE_TTL_SECONDS)
+
+
+def start_queue_logging() -> tuple[QueueHandler, QueueListener]:
+    """
+    Route root-logger output through a queue drained on a background thread.
+    
+    Log calls on request paths become a queue put; the handlers that actually
+    write to stdout run on the listener's thread.
+    """
+    root = logging.getLogger()
+    handlers = root.handlers[:] or [logging.StreamHandler()]
+    for h in handlers:
+        root.removeHandler(h)
+    
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    root.addHandler(queue_handler)
+    root.setLevel(logging.INFO)
+    
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return queue_handler, listener
+
+
+def stop_queue_logging(queue_handler: QueueHandler, listener: QueueListener) -> None:
+    """Flush queued records and hand the original handlers back to the root logger."""
+    listener.stop()
+    root = logging.getLogger()
+    root.removeHandler(queue_handler)
+    for h in listener.handlers:
+        root.addHandler(h)
+
+
+async def refresh_google_certs_safely():
+    """Refresh Google's signing certs, logging rather than raising on failure."""
+    try:
+        await run_in_threadpool(refresh_google_certs)
+    except Exception as e:
+        logger.error(f"Failed to refresh Google certs: {e}", exc_info=True)
+
+
+async def keep_google_certs_fresh():
+    """Background task that keeps Google's signing certs cached for sign-in."""
+    while True:
+        await asyncio.sleep(GOOGLE_CERTS_REFRESH_SECONDS)
+        await refresh_google_certs_safely()
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize resources on startup."""
     global handler, menu_generator, auth_service
     
-    # Check for MOCK_MODE
-    mock_mode = os.environ.get("MOCK_MODE", "false").lower() == "true"
+    queue_handler, log_listener = start_queue_logging()
+    log_password_hash_config()
     
-    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    mock_mode = MOCK_MODE
+    
+    project_id = GOOGLE_CLOUD_PROJECT
     if not project_id and not mock_mode:
         raise RuntimeError("GOOGLE_CLOUD_PROJECT environment variable is required")
     elif not project_id:
         project_id = "mock-project" # Fallback for local testing
     
-    location = os.environ.get("VERTEX_AI_LOCATION", "us-central1")
+    location = VERTEX_AI_LOCATION
+    
+    # Size the worker thread pool used for blocking work (bcrypt, SDK calls).
+    # Most of these threads just wait on Firestore/Vertex AI RPCs.
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens = 200
     
     # helper to log and mock
     def use_mock_handler():
         global handler
         from onboarding_agent import MockOnboardingConversationHandler
-        print("Using MockOnboardingConversationHandler")
+        logger.info("Using MockOnboardingConversationHandler")
         handler = MockOnboardingConversationHandler(project_id, location)
 
     def use_mock_auth():
         global auth_service
         from auth import MockAuthService
-        print("Using MockAuthService")
+        logger.info("Using MockAuthService")
         auth_service = MockAuthService()
 
+    # One Firestore client shared by every service: it's thread-safe and
+    # multiplexes all requests over a single gRPC channel. A pool of clients
+    # would only be drawn from here, once per service, so it would add idle
+    # channels rather than spread per-request load.
+    db = None
+    if not mock_mode:
+        try:
+            from google.cloud import firestore
+            db = firestore.Client(project=project_id)
+        except Exception as e:
+            logger.error(f"Failed to initialize Firestore client: {e}", exc_info=True)
+
     # Initialize Handler
     if mock_mode:
         use_mock_handler()
@@ -182,27 +292,29 @@ async def lifespan(app: FastAPI):
             handler = OnboardingConversationHandler(
                 project_id=project_id,
                 location=location,
+                db=db,
             )
         except Exception as e:
-            print(f"Failed to initialize OnboardingConversationHandler: {e}. ")
+            logger.error(f"Failed to initialize OnboardingConversationHandler: {e}", exc_info=True)
             if mock_mode: 
                  use_mock_handler()
             else:
-                 print("Onboarding endpoints will be unavailable.")
+                 logger.warning("Onboarding endpoints will be unavailable.")
                  handler = None
 
     # Initialize MenuGenerator
     if mock_mode:
-        print("Using MockMenuGenerator")
+        logger.info("Using MockMenuGenerator")
         menu_generator = MockMenuGenerator(project_id, location)
     else:
         try:
             menu_generator = MenuGenerator(
                 project_id=project_id,
                 location=location,
+                db=db,
             )
         except Exception as e:
-            print(f"Failed to initialize real MenuGenerator: {e}. Using Mock.")
+            logger.error(f"Failed to initialize real MenuGenerator: {e}. Using Mock.", exc_info=True)
             menu_generator = MockMenuGenerator(project_id, location)
     
     # Initialize Auth Service
@@ -210,23 +322,37 @@ async def lifespan(app: FastAPI):
         use_mock_auth()
     else:
         try:
-            from google.cloud import firestore
-            db = firestore.Client(project=project_id)
+            if db is None:
+                raise RuntimeError("Firestore client unavailable")
             auth_service = AuthService(db)
-            print("AuthService initialized successfully")
+            logger.info("AuthService initialized successfully")
         except Exception as e:
-            print(f"Failed to initialize AuthService: {e}")
+            logger.error(f"Failed to initialize AuthService: {e}", exc_info=True)
             if mock_mode:
                  use_mock_auth()
             else:
                  auth_service = None
     
+    # Fetch Google certs before taking traffic so the first Google sign-in
+    # verifies locally, then keep them refreshed in the background.
+    # (bcrypt is already warmed by the dummy hash computed when auth is imported.)
+    certs_task = None
+    if auth_service and not mock_mode and GOOGLE_CLIENT_ID:
+        await refresh_google_certs_safely()
+        certs_task = asyncio.create_task(keep_google_certs_fresh())
+    
+    # Build and cache every model's JSON schema now rather than on first /docs hit
+    app.openapi()
+    
     yield
     
     # Cleanup if needed
+    if certs_task:
+        certs_task.cancel()
     handler = None
     menu_generator = None
     auth_service = None
+    stop_queue_logging(queue_handler, log_listener)
 
 
 app = FastAPI(
@@ -258,17 +384,26 @@ app.add_middleware(
 # API Endpoints
 # =============================================================================
 
+# Health checks are polled constantly; serve the same pre-serialized body
+HEALTH_BODY = orjson.dumps(HealthResponse(status="healthy").model_dump())
+
+
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """Health check endpoint for Cloud Run."""
-    return HealthResponse(status="healthy")
+    return Response(content=HEALTH_BODY, media_type="application/json")
 
 
 # =============================================================================
 # Auth Endpoints
 # =============================================================================
 
-@app.post("/auth/signup", response_model=Token, status_code=status.HTTP_201_CREATED)
+@app.post(
+    "/auth/signup",
+    response_model=Token,
+    status_code=status.HTTP_201_CREATED,
+    dependencies=[Depends(auth_rate_limit)],
+)
 async def signup(request: SignupRequest):
     """Create a new user with email/password."""
     if not auth_service:
@@ -277,10 +412,10 @@ async def signup(request: SignupRequest):
             detail="Auth service not initialized"
         )
     
-    return auth_service.signup_with_email(request.email, request.password)
+    return await auth_service.signup_with_email(request.email, request.password)
 
 
-@app.post("/auth/login", response_model=Token)
+@app.post("/auth/login", response_model=Token, dependencies=[Depends(auth_rate_limit)])
 async def login(request: LoginRequest):
     """Authenticate with email/password."""
     if not auth_service:
@@ -289,7 +424,7 @@ async def login(request: LoginRequest):
             detail="Auth service not initialized"
         )
     
-    return auth_service.login_with_email(request.email, request.password)
+    return await auth_service.login_with_email(request.email, request.password)
 
 
 @app.post("/auth/google", response_model=Token)
@@ -301,7 +436,7 @@ async def google_auth(request: GoogleAuthRequest):
             detail="Auth service not initialized"
         )
     
-    return auth_service.auth_with_google(request.credential)
+    return await auth_service.auth_with_google(request.credential)
 
 
 @app.get("/auth/me", response_model=UserResponse)
@@ -326,7 +461,7 @@ async def mark_user_onboarded(current_user: dict = Depends(get_current_user)):
             detail="Auth service not initialized"
         )
     
-    auth_service.set_onboarded(current_user["user_id"])
+    await run_in_threadpool(auth_service.set_onboarded, current_user["user_id"])
     
     # Return a new token with updated onboarded status
     new_token = create_access_token(
@@ -362,10 +497,9 @@ async def start_conversation(request: StartConversationRequest):
         )
     
     try:
-        session_id, message = handler.start_conversation({
-            "city": request.city,
-            "country": request.country,
-        })
+        # The request body was already validated by FastAPI
+        location = LocationData.model_construct(city=request.city, country=request.country)
+        session_id, message = await run_in_threadpool(handler.start_conversation, location)
         
         return StartConversationResponse(
             session_id=session_id,
@@ -393,7 +527,7 @@ async def send_message(request: SendMessageRequest):
         )
     
     try:
-        message, is_complete = handler.send_message(
+        message, is_complete = await handler.send_message_async(
             session_id=request.session_id,
             user_message=request.message,
         )
@@ -415,14 +549,58 @@ async def send_message(request: SendMessageRequest):
         )
 
 
+@app.post("/onboarding/message/stream")
+async def send_message_stream(request: SendMessageRequest):
+    """
+    Send a message and stream the assistant's reply as Server-Sent Events.
+    
+    Emits `data: {"delta": ...}` events as the reply is generated, then a final
+    `data: {"done": true, "is_complete": ...}` event (or `data: {"error": ...}`).
+    """
+    if not handler:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Service not initialized"
+        )
+    
+    try:
+        events = await run_in_threadpool(
+            handler.send_message_stream,
+            session_id=request.session_id,
+            user_message=request.message,
+        )
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e)
+        )
+    
+    async def event_stream():
+        async for event in iterate_in_threadpool(events):
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+    
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
+def generate_first_menu(user_id: str) -> None:
+    """Background task: generate a newly onboarded user's first menu."""
+    try:
+        menu_generator.generate_menu_for_user(user_id)
+        logger.info(f"First menu generated for user {user_id}")
+    except Exception as e:
+        logger.error(f"Failed to generate first menu: {e}", exc_info=True)
+        # Don't surface the error - menu can be generated later
+
+
 @app.post("/onboarding/finalize", response_model=FinalizeProfileResponse)
-async def finalize_profile(request: FinalizeProfileRequest):
+async def finalize_profile(request: FinalizeProfileRequest, background_tasks: BackgroundTasks):
     """
     Finalize the conversation and save the user profile.
     
     Extracts structured data from the conversation using Gemini
     and saves the profile to Firestore.
-    Also marks the user as onboarded and triggers first menu generation.
+    Also marks the user as onboarded and schedules first menu generation
+    to run after the response is sent.
     """
     if not handler:
         raise HTTPException(
@@ -430,43 +608,51 @@ async def finalize_profile(request: FinalizeProfileRequest):
             detail="Service not initialized"
         )
     
+    # The auth lookup only needs the user id, so it runs while Gemini
+    # extracts the profile
+    user_task = None
+    if auth_service:
+        user_task = asyncio.create_task(
+            run_in_threadpool(auth_service.get_user_by_id, request.user_id)
+        )
+    
     try:
         profile = await handler.finalize_profile(
             user_id=request.user_id,
             session_id=request.session_id,
         )
+        profile_cache.pop(request.user_id, None)
+        menu_cache.pop(request.user_id, None)
         
         # Mark user as onboarded in auth system and get new token
         new_token = None
-        if auth_service:
+        if user_task:
             try:
-                auth_service.set_onboarded(request.user_id)
-                print(f"User {request.user_id} marked as onboarded")
+                # Independent Firestore calls: the email lookup doesn't need the flag set
+                _, user = await asyncio.gather(
+                    run_in_threadpool(auth_service.set_onboarded, request.user_id),
+                    user_task,
+                )
+                logger.info(f"User {request.user_id} marked as onboarded")
                 
                 # Get user email to create new token
-                user = auth_service.get_user_by_id(request.user_id)
                 if user:
                     new_token = create_access_token(
                         user_id=request.user_id,
                         email=user.email,
                         is_onboarded=True
                     )
-                    print(f"Generated new token for user {request.user_id} with is_onboarded=True")
+                    logger.info(f"Generated new token for user {request.user_id} with is_onboarded=True")
             except Exception as e:
-                print(f"Failed to mark user as onboarded: {e}")
+                logger.error(f"Failed to mark user as onboarded: {e}", exc_info=True)
         
-        # Trigger first menu generation for this user
+        # Trigger first menu generation for this user once the response is sent
         if menu_generator and hasattr(menu_generator, 'generate_menu_for_user'):
-            try:
-                print(f"Triggering first menu generation for user {request.user_id}")
-                menu_generator.generate_menu_for_user(request.user_id)
-                print(f"First menu generated for user {request.user_id}")
-            except Exception as e:
-                print(f"Failed to generate first menu: {e}")
-                # Don't fail the request - menu can be generated later
+            logger.info(f"Scheduling first menu generation for user {request.user_id}")
+            background_tasks.add_task(generate_first_menu, request.user_id)
         
         return FinalizeProfileResponse(
-            profile=profile.to_firestore_dict(),
+            profile=profile,
             success=True,
             access_token=new_token,
         )
@@ -481,9 +667,17 @@ async def finalize_profile(request: FinalizeProfileRequest):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
+    finally:
+        # No-op once awaited; drops the lookup if profile extraction failed.
+        # Awaiting it retrieves any exception so asyncio doesn't log it as
+        # never retrieved.
+        if user_task:
+            user_task.cancel()
+            with suppress(Exception, asyncio.CancelledError):
+                await user_task
 
 
-@app.get("/onboarding/history/{session_id}")
+@app.get("/onboarding/history/{session_id}", response_model=ConversationHistoryResponse)
 async def get_conversation_history(session_id: str):
     """
     Get the conversation history for a session.
@@ -497,7 +691,7 @@ async def get_conversation_history(session_id: str):
         )
     
     try:
-        history = handler.get_chat_history(session_id)
+        history = await run_in_threadpool(handler.get_chat_history, session_id)
         return {"session_id": session_id, "messages": history}
     
     except ValueError as e:
@@ -518,7 +712,11 @@ async def get_latest_menu(user_id: str):
             detail="Service not initialized"
         )
     
-    menu = menu_generator.get_latest_menu(user_id)
+    cached = menu_cache.get(user_id)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
+    menu = await run_in_threadpool(menu_generator.get_latest_menu, user_id)
     
     if not menu:
         raise HTTPException(
@@ -526,10 +724,12 @@ async def get_latest_menu(user_id: str):
             detail="No menu found for this user"
         )
     
-    return menu.to_firestore_dict()
+    menu_json = menu.model_dump_json()
+    menu_cache[user_id] = menu_json
+    return Response(content=menu_json, media_type="application/json")
 
 
-@app.get("/users/{user_id}", response_model=dict)
+@app.get("/users/{user_id}", response_model=UserProfile)
 async def get_user_profile(user_id: str):
     """
     Retrieve a user profile from Firestore.
@@ -540,6 +740,10 @@ async def get_user_profile(user_id: str):
             detail="Service not initialized"
         )
     
+    cached = profile_cache.get(user_id)
+    if cached is not None:
+        return Response(content=cached, media_type="application/json")
+    
     profile = await handler.get_user_profile(user_id)
     
     if not profile:
@@ -548,7 +752,9 @@ async def get_user_profile(user_id: str):
             detail=f"User not found: {user_id}"
         )
     
-    return profile.to_firestore_dict()
+    profile_json = profile.model_dump_json()
+    profile_cache[user_id] = profile_json
+    return Response(content=profile_json, media_type="application/json")
 
 
 @app.get("/debug/user/{user_id}")
@@ -568,38 +774,52 @@ async def debug_user_status(user_id: str):
         }
     }
     
+    async def not_checked():
+        return None
+    
+    # Run the three independent lookups concurrently
+    user, profile, menu = await asyncio.gather(
+        run_in_threadpool(auth_service.get_user_by_id, user_id) if auth_service else not_checked(),
+        handler.get_user_profile(user_id) if handler else not_checked(),
+        run_in_threadpool(menu_generator.get_latest_menu, user_id) if menu_generator else not_checked(),
+        return_exceptions=True,
+    )
+    
     # Check Auth
     if auth_service:
-        try:
-            user = auth_service.get_user_by_id(user_id)
+        if isinstance(user, Exception):
+            result["auth_user"] = f"Error: {user}"
+        else:
             result["auth_user"] = "Found" if user else "Not Found"
-        except Exception as e:
-            result["auth_user"] = f"Error: {e}"
             
     # Check Profile
     if handler:
-        try:
-            profile = await handler.get_user_profile(user_id)
+        if isinstance(profile, Exception):
+            result["profile"] = f"Error: {profile}"
+        else:
             result["profile"] = "Found" if profile else "Not Found"
             if profile:
                 result["profile_data_preview"] = str(profile.to_firestore_dict())[:100]
-        except Exception as e:
-            result["profile"] = f"Error: {e}"
             
     # Check Menu
     if menu_generator:
-        try:
-            menu = menu_generator.get_latest_menu(user_id)
+        if isinstance(menu, Exception):
+            result["menu"] = f"Error: {menu}"
+        else:
             result["menu"] = "Found" if menu else "Not Found"
-        except Exception as e:
-            result["menu"] = f"Error: {e}"
             
     return result
 
 
-# Mount static files (Frontend)
-# html=True allows serving index.html at root /
-app.mount("/", StaticFiles(directory="frontend", html=True), name="static")
+@app.get("/", include_in_schema=False)
+async def index():
+    """Serve the onboarding page at the site root."""
+    return FileResponse("frontend/index.html")
+
+
+# Mount static files (Frontend) under their own prefix so they can never
+# shadow API routes or turn API misses into filesystem lookups
+app.mount("/ui", StaticFiles(directory="frontend", html=True), name="static")
 
 
 # =============================================================================
@@ -610,4 +830,11 @@ if __name__ == "__main__":
     import uvicorn
     
     port = int(os.environ.get("PORT", 8080))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # The default loop/http ("auto") picks uvloop and httptools when installed
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        # Mock services live in process memory, so mock mode needs one worker
+        workers=1 if MOCK_MODE else int(os.environ.get("WEB_CONCURRENCY", 1)),
+    )
@@ -5,18 +5,23 @@ Generates weekly meal plans for users based on their profiles and preferences
 using Gemini 1.5 Flash via Vertex AI.
 """
 
+import asyncio
+import functools
+import hashlib
 import logging
-import json
 import os
-import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-# Delayed imports for google.cloud and vertexai to allow module loading without dependencies
-# from google.cloud import firestore
-# import vertexai
-# ...
-from pydantic import BaseModel, Field
+# google.cloud and vertexai are imported inside the methods that use them, so
+# importing this module (e.g. from main.py in MOCK_MODE) never loads the SDKs
+if TYPE_CHECKING:
+    import vertexai
+    from google.cloud import firestore
+
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from onboarding_agent import UserProfile, LocationData, HouseholdInfo, WeeklySchedule, DailyMeals
 
@@ -25,6 +30,34 @@ from onboarding_agent import UserProfile, LocationData, HouseholdInfo, WeeklySch
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Maximum number of menus generated concurrently by the batch job
+BATCH_CONCURRENCY = int(os.environ.get("MENU_BATCH_CONCURRENCY", "32"))
+
+# User profiles read ahead of the batch job's generation workers
+USER_QUEUE_SIZE = 64
+
+# Menus per Firestore WriteBatch (Firestore allows at most 500 writes per batch)
+SAVE_BATCH_SIZE = 450
+
+# Newest menus fetched per lookup, so one unreadable document doesn't hide older valid ones
+LATEST_MENU_CANDIDATES = 5
+
+# How long a generated menu can be reused for users with identical inputs
+PROMPT_CACHE_TTL = timedelta(days=7)
+
+DAYS_OF_WEEK = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+# User profile fields read by the batch job
+PROFILE_FIELDS = [
+    "user_id",
+    "location",
+    "household",
+    "dietary_preferences",
+    "allergies_dislikes",
+    "meal_schedule",
+]
+
+MEAL_LABELS = (("breakfast", "Breakfast"), ("lunch", "Lunch"), ("dinner", "Dinner"))
+
 
 # =============================================================================
 # Pydantic Models for Menu
@@ -36,6 +69,8 @@ logger = logging.getLogger(__name__)
 
 class MenuSlot(BaseModel):
     """Details for a specific meal."""
+    model_config = ConfigDict(frozen=True)
+
     name: str = Field(..., description="Name of the dish or 'SKIPPED'")
     description: str = Field(..., description="Brief description of the dish")
     ingredients: list[str] = Field(..., description="List of main ingredients")
@@ -60,6 +95,10 @@ class StrictWeeklyMenu(BaseModel):
     sunday: StrictDailyMenu
 
 
+# JSON schema Gemini generates against (computed once at import)
+MENU_RESPONSE_SCHEMA = StrictWeeklyMenu.model_json_schema()
+
+
 # =============================================================================
 # Pydantic Models for Persistence (With Optionals)
 # =============================================================================
@@ -70,6 +109,14 @@ class DailyMenu(BaseModel):
     lunch: Optional[MenuSlot] = None
     dinner: Optional[MenuSlot] = None
 
+    @field_validator("breakfast", "lunch", "dinner", mode="before")
+    @classmethod
+    def skipped_to_none(cls, value):
+        """Store slots Gemini marked as "SKIPPED" as empty."""
+        if isinstance(value, dict) and value.get("name") == "SKIPPED":
+            return None
+        return value
+
 
 class WeeklyMenu(BaseModel):
     """Weekly meal plan."""
@@ -90,13 +137,8 @@ class GeneratedMenuDocument(BaseModel):
     menu: WeeklyMenu
 
     def to_firestore_dict(self) -> dict:
-        """Convert to Firestore-compatible dictionary."""
-        return {
-            "user_id": self.user_id,
-            "week_start_date": self.week_start_date,
-            "created_at": self.created_at,
-            "menu": self.menu.model_dump(),
-        }
+        """Convert to Firestore-compatible dictionary (empty meal slots are omitted)."""
+        return self.model_dump(exclude_none=True)
 
 
 # =============================================================================
@@ -129,6 +171,36 @@ Instructions:
 Return the result as a JSON object adhering to the schema provided.
 """
 
+# The persona line never changes; only the part from "User Profile:" on is
+# interpolated per user. Keeping the static text as an exact, leading prefix
+# also lets Gemini reuse it across requests.
+_PROMPT_HEAD, _sep, _rest = MENU_GENERATION_PROMPT.partition("User Profile:")
+_PROMPT_BODY_TEMPLATE = _sep + _rest
+del _sep, _rest
+
+
+# =============================================================================
+# Shared SDK Clients
+# =============================================================================
+
+MODEL_NAME = "gemini-2.0-flash-001"
+
+
+@functools.lru_cache(maxsize=8)
+def _get_model(project_id: str, location: str, model_name: str) -> "vertexai.generative_models.GenerativeModel":
+    """One GenerativeModel (and gRPC channel) per process for each project/region/model."""
+    import vertexai
+    from vertexai.generative_models import GenerativeModel
+    vertexai.init(project=project_id, location=location)
+    return GenerativeModel(model_name)
+
+
+@functools.lru_cache(maxsize=8)
+def _get_firestore_client(project_id: str) -> "firestore.Client":
+    """One Firestore client per process for generators not handed a shared one."""
+    from google.cloud import firestore
+    return firestore.Client(project=project_id)
+
 
 # =============================================================================
 # Menu Generator Service
@@ -145,6 +217,8 @@ class MenuGenerator:
         location: str = "us-central1",
         menu_collection: str = "generated_menus",
         user_collection: str = "users",
+        prompt_cache_collection: str = "menu_prompt_cache",
+        db: Optional["firestore.Client"] = None,
     ):
         """
         Initialize the menu generator.
@@ -154,21 +228,26 @@ class MenuGenerator:
             location: Vertex AI region
             menu_collection: Firestore collection for generated menus
             user_collection: Firestore collection for user profiles
+            prompt_cache_collection: Firestore collection caching menus by prompt inputs
+            db: Shared Firestore client; one is created if not provided
         """
         self.project_id = project_id
         self.location = location
         self.menu_collection = menu_collection
         self.user_collection = user_collection
-
-        self.menu_collection = menu_collection
-        self.user_collection = user_collection
+        self.prompt_cache_collection = prompt_cache_collection
 
         # Initialize Vertex AI
         try:
-            import vertexai
-            from vertexai.generative_models import GenerativeModel
-            vertexai.init(project=project_id, location=location)
-            self.model = GenerativeModel("gemini-2.0-flash-001")
+            from vertexai.generative_models import GenerationConfig
+            self.model = _get_model(project_id, location, MODEL_NAME)
+            # Same settings for every menu; built once rather than per request
+            self._generation_config = GenerationConfig(
+                temperature=0.7,
+                max_output_tokens=8192,
+                response_mime_type="application/json",
+                response_schema=MENU_RESPONSE_SCHEMA,
+            )
             logger.info("Vertex AI initialized successfully")
         except ImportError:
              logger.error("Vertex AI libraries not installed.")
@@ -180,8 +259,7 @@ class MenuGenerator:
 
         # Initialize Firestore
         try:
-            from google.cloud import firestore
-            self.db = firestore.Client(project=project_id)
+            self.db = db if db is not None else _get_firestore_client(project_id)
             logger.info("Firestore client initialized successfully")
         except ImportError:
              logger.error("Firestore libraries not installed.")
@@ -197,88 +275,167 @@ class MenuGenerator:
         """
         logger.info(f"Generating menu for user: {user_profile.user_id}")
 
-        schedule_desc = self._format_schedule_description(user_profile.meal_schedule)
-        
-        prompt = MENU_GENERATION_PROMPT.format(
-            city=user_profile.location.city,
-            country=user_profile.location.country,
-            adults=user_profile.household.adults,
-            children=user_profile.household.children,
-            dietary_preferences=", ".join(user_profile.dietary_preferences) or "None",
-            allergies_dislikes=", ".join(user_profile.allergies_dislikes) or "None",
-            schedule_description=schedule_desc
-        )
+        if not self._cooks_at_home(user_profile.meal_schedule):
+            return WeeklyMenu(**{day: DailyMenu() for day in DAYS_OF_WEEK})
+
+        cache_key = self._prompt_cache_key(user_profile, week_start_date)
+        cached_menu = self._get_cached_menu(cache_key)
+        if cached_menu:
+            return cached_menu
+
+        prompt = self._build_menu_prompt(user_profile)
 
         try:
-            from vertexai.generative_models import GenerationConfig
             response = self.model.generate_content(
                 prompt,
-                generation_config=GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=8192,
-                    response_mime_type="application/json",
-                    response_schema=StrictWeeklyMenu.model_json_schema(),
-                ),
+                generation_config=self._generation_config,
             )
-            
-            # Parse response into Strict models
-            menu_data = json.loads(response.text)
-            strict_menu = StrictWeeklyMenu(**menu_data)
-            
-            # Convert to nullable WeeklyMenu
-            return self._convert_strict_to_weekly_menu(strict_menu)
+            menu = self._parse_menu_response(response.text)
+            self._cache_menu(cache_key, response.text)
+            return menu
 
         except Exception as e:
             logger.error(f"Error generating menu for user {user_profile.user_id}: {e}")
             return None
 
-    def _convert_strict_to_weekly_menu(self, strict_menu: StrictWeeklyMenu) -> WeeklyMenu:
-        """Convert StrictWeeklyMenu (with SKIPPED) to WeeklyMenu (with None)."""
-        
-        def convert_daily(strict_daily: StrictDailyMenu) -> DailyMenu:
-            return DailyMenu(
-                breakfast=strict_daily.breakfast if strict_daily.breakfast.name != "SKIPPED" else None,
-                lunch=strict_daily.lunch if strict_daily.lunch.name != "SKIPPED" else None,
-                dinner=strict_daily.dinner if strict_daily.dinner.name != "SKIPPED" else None,
+    async def generate_weekly_menu_async(self, user_profile: UserProfile, week_start_date: str) -> Optional[WeeklyMenu]:
+        """
+        Async variant of generate_weekly_menu, used by the batch job to keep
+        many Gemini calls in flight at once.
+        """
+        logger.info(f"Generating menu for user: {user_profile.user_id}")
+
+        if not self._cooks_at_home(user_profile.meal_schedule):
+            return WeeklyMenu(**{day: DailyMenu() for day in DAYS_OF_WEEK})
+
+        cache_key = self._prompt_cache_key(user_profile, week_start_date)
+        cached_menu = await asyncio.to_thread(self._get_cached_menu, cache_key)
+        if cached_menu:
+            return cached_menu
+
+        prompt = self._build_menu_prompt(user_profile)
+
+        try:
+            response = await self.model.generate_content_async(
+                prompt,
+                generation_config=self._generation_config,
             )
+            menu = self._parse_menu_response(response.text)
+            await asyncio.to_thread(self._cache_menu, cache_key, response.text)
+            return menu
 
-        return WeeklyMenu(
-            monday=convert_daily(strict_menu.monday),
-            tuesday=convert_daily(strict_menu.tuesday),
-            wednesday=convert_daily(strict_menu.wednesday),
-            thursday=convert_daily(strict_menu.thursday),
-            friday=convert_daily(strict_menu.friday),
-            saturday=convert_daily(strict_menu.saturday),
-            sunday=convert_daily(strict_menu.sunday),
+        except Exception as e:
+            logger.error(f"Error generating menu for user {user_profile.user_id}: {e}")
+            return None
+
+    def _cooks_at_home(self, schedule: WeeklySchedule) -> bool:
+        """Whether any meal in the week is cooked at home (otherwise there's nothing to generate)."""
+        return any(
+            getattr(getattr(schedule, day), meal)
+            for day in DAYS_OF_WEEK
+            for meal, _ in MEAL_LABELS
         )
 
+    def _prompt_cache_key(self, user_profile: UserProfile, week_start_date: str) -> str:
+        """
+        Hash the normalized inputs that determine a menu prompt.
+
+        The week is part of the key so users with identical profiles share a
+        menu within a week but still get a fresh one each week.
+        """
+        schedule = user_profile.meal_schedule
+        key_parts = [
+            week_start_date,
+            user_profile.location.city.strip().lower(),
+            user_profile.location.country.strip().lower(),
+            user_profile.household.adults,
+            user_profile.household.children,
+            sorted(p.strip().lower() for p in user_profile.dietary_preferences),
+            sorted(a.strip().lower() for a in user_profile.allergies_dislikes),
+            [
+                [meals.breakfast, meals.lunch, meals.dinner]
+                for meals in (getattr(schedule, day) for day in DAYS_OF_WEEK)
+            ],
+        ]
+        return hashlib.sha256(orjson.dumps(key_parts)).hexdigest()
+
+    def _get_cached_menu(self, cache_key: str) -> Optional[WeeklyMenu]:
+        """Return a previously generated menu for these prompt inputs, if still fresh."""
+        try:
+            doc = self.db.collection(self.prompt_cache_collection).document(cache_key).get()
+            if not doc.exists:
+                return None
+            
+            data = doc.to_dict()
+            if data["expires_at"] <= datetime.now(timezone.utc):
+                return None
+            
+            logger.info(f"Prompt cache hit: {cache_key}")
+            return self._parse_menu_response(data["menu"])
+            
+        except Exception as e:
+            logger.warning(f"Prompt cache lookup failed for {cache_key}: {e}")
+            return None
+
+    def _cache_menu(self, cache_key: str, menu_text: str) -> None:
+        """Store Gemini's validated menu JSON for reuse by identical prompts."""
+        try:
+            now = datetime.now(timezone.utc)
+            self.db.collection(self.prompt_cache_collection).document(cache_key).set({
+                "menu": menu_text,
+                "created_at": now,
+                # Also usable as a Firestore TTL policy field
+                "expires_at": now + PROMPT_CACHE_TTL,
+            })
+        except Exception as e:
+            logger.warning(f"Failed to cache menu for {cache_key}: {e}")
+
+    def _build_menu_prompt(self, user_profile: UserProfile) -> str:
+        """Fill the menu generation prompt from a user's profile."""
+        schedule_desc = self._format_schedule_description(user_profile.meal_schedule)
+        
+        return _PROMPT_HEAD + _PROMPT_BODY_TEMPLATE.format_map({
+            "city": user_profile.location.city,
+            "country": user_profile.location.country,
+            "adults": user_profile.household.adults,
+            "children": user_profile.household.children,
+            "dietary_preferences": ", ".join(user_profile.dietary_preferences) or "None",
+            "allergies_dislikes": ", ".join(user_profile.allergies_dislikes) or "None",
+            "schedule_description": schedule_desc,
+        })
+
+    def _parse_menu_response(self, response_text: str) -> WeeklyMenu:
+        """
+        Parse Gemini's JSON output into a WeeklyMenu.
+
+        Gemini fills every slot per StrictWeeklyMenu; DailyMenu's validator
+        turns the "SKIPPED" ones into None while parsing.
+        """
+        return WeeklyMenu.model_validate_json(response_text)
+
     def _format_schedule_description(self, schedule: WeeklySchedule) -> str:
         """Helper to create a readable description of the cooking schedule."""
         lines = []
-        days = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
-        
-        for day in days:
+        for day in DAYS_OF_WEEK:
             daily_meals: DailyMeals = getattr(schedule, day)
-            meals = []
-            if daily_meals.breakfast: includes = meals.append("Breakfast")
-            if daily_meals.lunch: includes = meals.append("Lunch")
-            if daily_meals.dinner: includes = meals.append("Dinner")
-            
-            if meals:
-                lines.append(f"- {day.capitalize()}: {', '.join(meals)}")
-            else:
-                lines.append(f"- {day.capitalize()}: No meals cooked at home")
-                
+            meals = [label for attr, label in MEAL_LABELS if getattr(daily_meals, attr)]
+            lines.append(f"- {day.capitalize()}: {', '.join(meals) if meals else 'No meals cooked at home'}")
         return "\n".join(lines)
 
-    def save_menu(self, user_id: str, week_start_date: str, menu: WeeklyMenu) -> None:
-        """Save the generated menu to Firestore."""
+    def save_menu(
+        self,
+        user_id: str,
+        week_start_date: str,
+        menu: WeeklyMenu,
+        created_at: Optional[datetime] = None,
+    ) -> None:
+        """Save the generated menu to Firestore (created_at defaults to now, UTC)."""
         try:
             doc_id = f"{user_id}_{week_start_date}"
             menu_doc = GeneratedMenuDocument(
                 user_id=user_id,
                 week_start_date=week_start_date,
-                created_at=datetime.now(timezone.utc),
+                created_at=created_at or datetime.now(timezone.utc),
                 menu=menu
             )
             
@@ -290,29 +447,52 @@ class MenuGenerator:
             logger.error(f"Error saving menu for {user_id}: {e}")
             raise
 
+    def save_menus_batch(self, menu_docs: list[GeneratedMenuDocument]) -> None:
+        """Save many generated menus, committing up to SAVE_BATCH_SIZE writes per batch."""
+        collection = self.db.collection(self.menu_collection)
+        
+        for start in range(0, len(menu_docs), SAVE_BATCH_SIZE):
+            batch = self.db.batch()
+            for menu_doc in menu_docs[start:start + SAVE_BATCH_SIZE]:
+                doc_id = f"{menu_doc.user_id}_{menu_doc.week_start_date}"
+                batch.set(collection.document(doc_id), menu_doc.to_firestore_dict())
+            batch.commit()
+        
+        logger.info(f"Saved batch of {len(menu_docs)} menus")
+
     def get_latest_menu(self, user_id: str) -> Optional[GeneratedMenuDocument]:
-        """Retrieve the latest generated menu for a user."""
+        """
+        Retrieve the latest generated menu for a user.
+
+        Sorting and limiting happen in Firestore, so only the newest few
+        documents are read; the first one that validates is returned.
+        Requires the composite index on generated_menus (user_id ASC,
+        week_start_date DESC) defined in firestore.indexes.json (deploy with
+        `firebase deploy --only firestore:indexes`). A missing index raises
+        instead of looking like "no menu".
+        """
+        from google.api_core.exceptions import FailedPrecondition
         try:
-            # Query for user's menus
             from google.cloud import firestore
-            docs = self.db.collection(self.menu_collection).where("user_id", "==", user_id).stream()
+            # week_start_date is YYYY-MM-DD, so string order is date order
+            query = (
+                self.db.collection(self.menu_collection)
+                .where("user_id", "==", user_id)
+                .order_by("week_start_date", direction=firestore.Query.DESCENDING)
+                .limit(LATEST_MENU_CANDIDATES)
+            )
             
-            all_menus = []
-            for doc in docs:
+            for doc in query.stream():
                 try:
-                    all_menus.append(GeneratedMenuDocument(**doc.to_dict()))
+                    return GeneratedMenuDocument(**doc.to_dict())
                 except Exception as parse_error:
-                    logger.warning(f"Skipping invalid menu document {doc.id}: {parse_error}")
-                    continue
-            
-            if not all_menus:
-                return None
-            
-            # Sort by week_start_date descending (YYYY-MM-DD string sort works)
-            all_menus.sort(key=lambda x: x.week_start_date, reverse=True)
+                    logger.warning(f"Invalid menu document {doc.id}: {parse_error}")
             
-            return all_menus[0]
+            return None
             
+        except FailedPrecondition as e:
+            logger.error(f"Latest-menu query failed, is the generated_menus index deployed? {e}")
+            raise
         except Exception as e:
             logger.error(f"Error retrieving latest menu for {user_id}: {e}")
             return None
@@ -334,20 +514,15 @@ class MenuGenerator:
                 logger.error(f"User profile not found: {user_id}")
                 return False
             
-            user_data = user_doc.to_dict()
-            
             # Reconstruct UserProfile from Firestore data
-            user_profile = UserProfile(
-                user_id=user_data.get("user_id", user_id),
-                location=LocationData(**user_data.get("location", {})),
-                household=HouseholdInfo(**user_data.get("household", {"adults": 1, "children": 0})),
-                dietary_preferences=user_data.get("dietary_preferences", []),
-                allergies_dislikes=user_data.get("allergies_dislikes", []),
-                meal_schedule=WeeklySchedule(**user_data.get("meal_schedule", {})),
-            )
+            user_profile = UserProfile.model_validate({
+                "user_id": user_id,
+                "household": {"adults": 1, "children": 0},
+                **user_doc.to_dict(),
+            })
             
             # Calculate this week's start date (current Monday)
-            today = datetime.now()
+            today = datetime.now(timezone.utc)
             current_monday = today - timedelta(days=today.weekday())
             week_start_date = current_monday.strftime("%Y-%m-%d")
             
@@ -369,44 +544,96 @@ class MenuGenerator:
     def process_all_users(self):
         """
         Batch process to generate menus for all users.
+        
+        Runs as a pipeline: a reader streams user profiles into a bounded
+        queue, BATCH_CONCURRENCY workers generate menus from it, and a writer
+        saves finished menus in WriteBatches. Reading, generating and writing
+        all overlap.
         """
+        asyncio.run(self._process_all_users_async())
+
+    async def _process_all_users_async(self):
         logger.info("Starting batch menu generation job")
         
+        # Firestore calls run in threads; size the pool to the fan-out so the
+        # default executor (cpu_count + 4 threads) doesn't become the limit
+        asyncio.get_running_loop().set_default_executor(
+            ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+        )
+        
         # Calculate next week's start date (next Monday)
-        today = datetime.now()
-        next_monday = today + timedelta(days=(7 - today.weekday()))
+        # One timestamp for the whole run: week start and every menu's created_at
+        now_utc = datetime.now(timezone.utc)
+        next_monday = now_utc + timedelta(days=(7 - now_utc.weekday()))
         week_start_date = next_monday.strftime("%Y-%m-%d")
         
-        users_ref = self.db.collection(self.user_collection)
+        # Only fetch the profile fields menu generation uses
+        users_query = self.db.collection(self.user_collection).select(PROFILE_FIELDS)
         
-        success_count = 0
-        error_count = 0
+        # None marks the end of each queue
+        user_queue: asyncio.Queue = asyncio.Queue(maxsize=USER_QUEUE_SIZE)
+        menu_queue: asyncio.Queue = asyncio.Queue()
+        user_count = 0
+        saved_count = 0
         
-        for doc in users_ref.stream():
+        async def reader() -> None:
+            nonlocal user_count
             try:
-                user_data = doc.to_dict()
-                # Reconstruct UserProfile from Firestore data
-                # Note: We need to handle potential schema mismatches gracefully
-                user_profile = UserProfile(
-                    user_id=user_data["user_id"],
-                    location=LocationData(**user_data["location"]),
-                    household=HouseholdInfo(**user_data["household"]),
-                    dietary_preferences=user_data.get("dietary_preferences", []),
-                    allergies_dislikes=user_data.get("allergies_dislikes", []),
-                    meal_schedule=WeeklySchedule(**user_data.get("meal_schedule", {})),
-                )
-                
-                menu = self.generate_weekly_menu(user_profile, week_start_date)
-                
-                if menu:
-                    self.save_menu(user_profile.user_id, week_start_date, menu)
-                    success_count += 1
-                else:
-                    error_count += 1
+                # Each next() may fetch a page from Firestore, so step the stream in a thread
+                docs = users_query.stream()
+                while (doc := await asyncio.to_thread(next, docs, None)) is not None:
+                    user_count += 1
+                    await user_queue.put(doc)
+            except Exception as e:
+                logger.error(f"Error streaming user profiles: {e}")
+            finally:
+                for _ in range(BATCH_CONCURRENCY):
+                    await user_queue.put(None)
+        
+        async def worker() -> None:
+            while (doc := await user_queue.get()) is not None:
+                try:
+                    # Reconstruct UserProfile from Firestore data; documents
+                    # that don't match the schema fail validation and are counted as errors
+                    user_profile = UserProfile.model_validate(doc.to_dict())
                     
+                    menu = await self.generate_weekly_menu_async(user_profile, week_start_date)
+                    
+                    if menu:
+                        await menu_queue.put(GeneratedMenuDocument(
+                            user_id=user_profile.user_id,
+                            week_start_date=week_start_date,
+                            created_at=now_utc,
+                            menu=menu,
+                        ))
+                        
+                except Exception as e:
+                    logger.error(f"Error processing user {doc.id}: {e}")
+        
+        async def flush_menus(menu_docs: list[GeneratedMenuDocument]) -> None:
+            nonlocal saved_count
+            try:
+                await asyncio.to_thread(self.save_menus_batch, menu_docs)
+                saved_count += len(menu_docs)
             except Exception as e:
-                logger.error(f"Error processing user {doc.id}: {e}")
-                error_count += 1
-                continue
+                logger.error(f"Error saving batch of {len(menu_docs)} menus: {e}")
+        
+        async def writer() -> None:
+            pending_menus: list[GeneratedMenuDocument] = []
+            while (menu_doc := await menu_queue.get()) is not None:
+                pending_menus.append(menu_doc)
+                if len(pending_menus) >= SAVE_BATCH_SIZE:
+                    await flush_menus(pending_menus)
+                    pending_menus = []
+            if pending_menus:
+                await flush_menus(pending_menus)
+        
+        writer_task = asyncio.create_task(writer())
+        await asyncio.gather(reader(), *(worker() for _ in range(BATCH_CONCURRENCY)))
+        await menu_queue.put(None)
+        await writer_task
+        
+        success_count = saved_count
+        error_count = user_count - saved_count
 
         logger.info(f"Job completed. Success: {success_count}, Errors: {error_count}")
@@ -0,0 +1,87 @@
+"""
+Auth Index Migration
+
+One-off script that backfills the email and Google ID lookup collections
+used by AuthService for users created before those collections existed.
+Rollout, per project:
+  1. Run this script.
+  2. Deploy the keyed-lookup auth code with AUTH_INDEX_FALLBACK=true, so
+     users who signed up on the old code after step 1 are still found (and
+     their index entries written) by a users-collection query.
+  3. Once the old revision serves no traffic, run this script again.
+  4. Remove AUTH_INDEX_FALLBACK from the service; index misses are then a
+     single document get.
+
+Accounts whose emails differ only in case (or that share a Google ID) would
+map to the same index document; they are reported and left unindexed rather
+than silently overwriting one another.
+"""
+
+import os
+import logging
+from collections import defaultdict
+from google.cloud import firestore
+
+from auth import EMAIL_INDEX_COLLECTION, GOOGLE_INDEX_COLLECTION, email_key
+
+# Configure logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Firestore caps a single batch commit at 500 writes
+BATCH_SIZE = 500
+
+
+def main():
+    project_id = os.environ.get("GOOGLE_CLOUD_PROJECT")
+    if not project_id:
+        logger.error("GOOGLE_CLOUD_PROJECT environment variable is required")
+        return
+
+    db = firestore.Client(project=project_id)
+    email_index = db.collection(EMAIL_INDEX_COLLECTION)
+    google_index = db.collection(GOOGLE_INDEX_COLLECTION)
+
+    # Collect owners per index key first, so accounts whose emails differ only
+    # in case are reported instead of overwriting each other's entry
+    email_owners = defaultdict(list)  # {email key: [(user_id, email)]}
+    google_owners = defaultdict(list)  # {google_id: [(user_id, email)]}
+    writes = []  # (method, document reference, data)
+
+    for doc in db.collection("auth_users").stream():
+        data = doc.to_dict()
+        owner = (data["user_id"], data["email"])
+        email_owners[email_key(data["email"])].append(owner)
+        if data.get("google_id"):
+            google_owners[data["google_id"]].append(owner)
+        if "email_lc" not in data:
+            writes.append(("update", doc.reference, {"email_lc": data["email"].lower()}))
+
+    collisions = 0
+    for index, owners in ((email_index, email_owners), (google_index, google_owners)):
+        for key, users in owners.items():
+            if len(users) > 1:
+                collisions += 1
+                logger.error(f"Not indexing {index.id}/{key}: shared by {users}")
+                continue
+            writes.append(("set", index.document(key), {"user_id": users[0][0]}))
+
+    batch = db.batch()
+    for n, (method, ref, data) in enumerate(writes, start=1):
+        getattr(batch, method)(ref, data)
+        if n % BATCH_SIZE == 0:
+            batch.commit()
+            batch = db.batch()
+    if len(writes) % BATCH_SIZE:
+        batch.commit()
+
+    logger.info(f"Backfilled auth indexes: {len(writes)} writes")
+    if collisions:
+        logger.error(
+            f"{collisions} index keys are shared by several accounts; merge or "
+            "rename those accounts, then re-run this script"
+        )
+
+
+if __name__ == "__main__":
+    main()
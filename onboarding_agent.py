@@ -5,24 +5,31 @@ AI-powered conversational onboarding that collects user preferences
 for personalized meal planning using Gemini 1.5 Flash via Vertex AI.
 """
 
-import json
+import asyncio
 import logging
 import os
+import re
+import threading
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from typing import Optional
+from typing import Iterator, Optional
 
 # Delayed imports to allow module loading without dependencies
 # from google.cloud import firestore
 # import vertexai
 # ...
 
-from pydantic import BaseModel, Field
+import orjson
+from cachetools import TTLCache
+from pydantic import BaseModel, ConfigDict, Field
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_UTC = timezone.utc
+
 
 # =============================================================================
 # Pydantic Models
@@ -30,18 +37,24 @@ logger = logging.getLogger(__name__)
 
 class LocationData(BaseModel):
     """Location data from Google Maps for cold-start strategy."""
+    model_config = ConfigDict(frozen=True)
+
     city: str
     country: str
 
 
 class HouseholdInfo(BaseModel):
     """Household composition."""
+    model_config = ConfigDict(frozen=True)
+
     adults: int = Field(default=1, ge=0)
     children: int = Field(default=0, ge=0)
 
 
 class DailyMeals(BaseModel):
     """Meals to plan for a specific day."""
+    model_config = ConfigDict(frozen=True)
+
     breakfast: bool = Field(default=False, description="Cook at home")
     lunch: bool = Field(default=False, description="Cook at home")
     dinner: bool = Field(default=True, description="Cook at home")
@@ -66,7 +79,7 @@ class UserProfile(BaseModel):
     dietary_preferences: list[str] = Field(default_factory=list)
     allergies_dislikes: list[str] = Field(default_factory=list)
     meal_schedule: WeeklySchedule = Field(default_factory=WeeklySchedule)
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(_UTC))
 
     def to_firestore_dict(self) -> dict:
         """Convert to Firestore-compatible dictionary."""
@@ -89,6 +102,8 @@ class UserProfile(BaseModel):
 
 class ChatMessage(BaseModel):
     """A single message in the conversation."""
+    model_config = ConfigDict(frozen=True)
+
     role: str  # "user" or "assistant"
     content: str
 
@@ -98,9 +113,15 @@ class ConversationState(BaseModel):
     session_id: str
     location: LocationData
     messages: list[ChatMessage] = Field(default_factory=list)
+    user_turn_count: int = 0  # Number of user messages, kept in step by add_user_message
     is_complete: bool = False
-    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
-    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    created_at: datetime = Field(default_factory=lambda: datetime.now(_UTC))
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(_UTC))
+
+    def add_user_message(self, content: str) -> None:
+        """Append a user message and count the turn."""
+        self.messages.append(ChatMessage(role="user", content=content))
+        self.user_turn_count += 1
 
     def to_firestore_dict(self) -> dict:
         """Convert to Firestore-compatible dictionary."""
@@ -111,6 +132,7 @@ class ConversationState(BaseModel):
                 "country": self.location.country,
             },
             "messages": [msg.model_dump() for msg in self.messages],
+            "user_turn_count": self.user_turn_count,
             "is_complete": self.is_complete,
             "created_at": self.created_at,
             "updated_at": self.updated_at,
@@ -119,13 +141,25 @@ class ConversationState(BaseModel):
     @classmethod
     def from_firestore_dict(cls, data: dict) -> "ConversationState":
         """Create from Firestore document."""
+        messages = [ChatMessage(**msg) for msg in data.get("messages", [])]
+        created_at = data.get("created_at")
+        updated_at = data.get("updated_at")
+        if created_at is None or updated_at is None:
+            now = datetime.now(_UTC)
+            created_at = created_at or now
+            updated_at = updated_at or now
+        user_turn_count = data.get("user_turn_count")
+        if user_turn_count is None:
+            # Sessions saved before the counter existed
+            user_turn_count = sum(1 for msg in messages if msg.role == "user")
         return cls(
             session_id=data["session_id"],
             location=LocationData(**data["location"]),
-            messages=[ChatMessage(**msg) for msg in data.get("messages", [])],
+            messages=messages,
+            user_turn_count=user_turn_count,
             is_complete=data.get("is_complete", False),
-            created_at=data.get("created_at", datetime.now(timezone.utc)),
-            updated_at=data.get("updated_at", datetime.now(timezone.utc)),
+            created_at=created_at,
+            updated_at=updated_at,
         )
 
 
@@ -151,6 +185,13 @@ Guidelines:
 IMPORTANT: Do NOT make up or assume information the user hasn't provided. Only use what they explicitly tell you."""
 
 
+def _as_location(location_data: dict | LocationData) -> LocationData:
+    """Return a LocationData, validating only when given a raw dict."""
+    if isinstance(location_data, LocationData):
+        return location_data
+    return LocationData(**location_data)
+
+
 def get_cold_start_prompt(location: LocationData) -> str:
     """Generate a location-aware welcome message prompt."""
     return f"""The user is located in {location.city}, {location.country}.
@@ -191,48 +232,78 @@ Conversation to analyze:
 
 Extract and return ONLY the JSON object, no other text."""
 
+# Split once so each extraction is a plain concatenation rather than a template scan
+_EXTRACTION_PREFIX, _EXTRACTION_SUFFIX = EXTRACTION_PROMPT.split("{conversation}", 1)
+
 
 # =============================================================================
 # Location-based Defaults (Cold Start Strategy)
 # =============================================================================
 
-LOCATION_CUISINE_DEFAULTS: dict[str, list[str]] = {
+_DEFAULT_CUISINES: tuple[str, ...] = ("International",)
+
+LOCATION_CUISINE_DEFAULTS: dict[str, tuple[str, ...]] = {
     # Europe
-    "Italy": ["Mediterranean", "Italian"],
-    "Spain": ["Mediterranean", "Spanish"],
-    "Greece": ["Mediterranean", "Greek"],
-    "France": ["French", "Mediterranean"],
-    "Germany": ["German", "European"],
-    "United Kingdom": ["British", "European"],
-    "Poland": ["Polish", "Eastern European"],
-    "Ukraine": ["Ukrainian", "Eastern European"],
+    "Italy": ("Mediterranean", "Italian"),
+    "Spain": ("Mediterranean", "Spanish"),
+    "Greece": ("Mediterranean", "Greek"),
+    "France": ("French", "Mediterranean"),
+    "Germany": ("German", "European"),
+    "United Kingdom": ("British", "European"),
+    "Poland": ("Polish", "Eastern European"),
+    "Ukraine": ("Ukrainian", "Eastern European"),
     
     # Asia
-    "Japan": ["Japanese", "Asian"],
-    "China": ["Chinese", "Asian"],
-    "South Korea": ["Korean", "Asian"],
-    "Thailand": ["Thai", "Asian"],
-    "Vietnam": ["Vietnamese", "Asian"],
-    "India": ["Indian", "South Asian"],
+    "Japan": ("Japanese", "Asian"),
+    "China": ("Chinese", "Asian"),
+    "South Korea": ("Korean", "Asian"),
+    "Thailand": ("Thai", "Asian"),
+    "Vietnam": ("Vietnamese", "Asian"),
+    "India": ("Indian", "South Asian"),
     
     # Americas
-    "United States": ["American", "Diverse"],
-    "Mexico": ["Mexican", "Latin American"],
-    "Brazil": ["Brazilian", "Latin American"],
-    "Argentina": ["Argentine", "Latin American"],
-    "Canada": ["North American", "Diverse"],
+    "United States": ("American", "Diverse"),
+    "Mexico": ("Mexican", "Latin American"),
+    "Brazil": ("Brazilian", "Latin American"),
+    "Argentina": ("Argentine", "Latin American"),
+    "Canada": ("North American", "Diverse"),
     
     # Middle East & Africa
-    "Turkey": ["Turkish", "Mediterranean"],
-    "Israel": ["Israeli", "Mediterranean", "Middle Eastern"],
-    "Morocco": ["Moroccan", "North African"],
-    "Egypt": ["Egyptian", "Middle Eastern"],
+    "Turkey": ("Turkish", "Mediterranean"),
+    "Israel": ("Israeli", "Mediterranean", "Middle Eastern"),
+    "Morocco": ("Moroccan", "North African"),
+    "Egypt": ("Egyptian", "Middle Eastern"),
 }
 
 
-def get_location_defaults(country: str) -> list[str]:
+def get_location_defaults(country: str) -> tuple[str, ...]:
     """Get default cuisine preferences based on country."""
-    return LOCATION_CUISINE_DEFAULTS.get(country, ["International"])
+    return LOCATION_CUISINE_DEFAULTS.get(country, _DEFAULT_CUISINES)
+
+
+# Most recent messages replayed to Gemini each turn (the last three exchanges).
+# A full onboarding runs to 9 messages, so the greeting and first answer drop
+# out of the later turns, keeping per-turn input tokens down.
+MAX_HISTORY_MESSAGES = 6
+
+# Generation settings for conversational replies (Vertex AI accepts a plain
+# dict, so this needs no SDK import at module load)
+CHAT_GENERATION_CONFIG = {"temperature": 0.7, "max_output_tokens": 256}
+
+ALREADY_COMPLETE_REPLY = "We've already collected your preferences. Thank you!"
+
+# Phrases in the assistant's reply that signal it has everything it needs,
+# matched case-insensitively in a single pass
+_COMPLETION_PHRASES = (
+    "all set",
+    "you're all set",
+    "that's everything",
+    "have everything i need",
+    "got everything",
+    "perfect!",
+    "thank you for sharing",
+)
+_COMPLETION_RE = re.compile("|".join(map(re.escape, _COMPLETION_PHRASES)), re.IGNORECASE)
 
 
 # =============================================================================
@@ -252,6 +323,7 @@ class FirestoreSessionStore:
         db: "firestore.Client",
         collection_name: str = "onboarding_sessions",
         session_ttl_hours: int = 1,
+        cache_ttl_seconds: float = 30.0,
     ):
         """
         Initialize the session store.
@@ -260,25 +332,57 @@ class FirestoreSessionStore:
             db: Firestore client instance
             collection_name: Collection name for sessions
             session_ttl_hours: Session time-to-live in hours
+            cache_ttl_seconds: How recently a session must have been updated
+                for read-only lookups to reuse this process's copy. Each
+                worker has its own cache, so history reads may lag a turn
+                saved by another worker by up to this long.
         """
         self.db = db
         self.collection_name = collection_name
         self.session_ttl = timedelta(hours=session_ttl_hours)
+        # Per-process cache for read-only lookups. Writers always read from
+        # Firestore: another worker may have saved a newer turn since.
+        self._cache: TTLCache = TTLCache(maxsize=4096, ttl=cache_ttl_seconds)
+        self._cache_freshness = timedelta(seconds=cache_ttl_seconds)
+        self._cache_lock = threading.Lock()
         logger.info(f"Firestore session store initialized: {collection_name}")
 
     def save_session(self, session: ConversationState) -> None:
         """Save or update a session in Firestore."""
         try:
-            session.updated_at = datetime.now(timezone.utc)
+            session.updated_at = datetime.now(_UTC)
             doc_ref = self.db.collection(self.collection_name).document(session.session_id)
             doc_ref.set(session.to_firestore_dict())
+            # Cache a snapshot of what was written, not the caller's live object
+            with self._cache_lock:
+                self._cache[session.session_id] = session.model_copy(deep=True)
             logger.debug(f"Saved session: {session.session_id}")
         except Exception as e:
             logger.error(f"Error saving session {session.session_id}: {e}")
             raise
 
-    def get_session(self, session_id: str) -> Optional[ConversationState]:
-        """Retrieve a session from Firestore."""
+    def get_session(self, session_id: str, cached: bool = False) -> Optional[ConversationState]:
+        """
+        Retrieve a session from Firestore.
+
+        With cached=True, this process's copy is returned without a Firestore
+        call if the session's updated_at is within the cache window (Python has
+        no Source.cache, so this stands in for it); otherwise it is fetched.
+        A cache hit skips the expiry check, since the window is far shorter
+        than the session TTL. The cache only holds snapshots of saved or
+        fetched state and hands out copies, so callers may modify the result.
+
+        Only use it for read-only lookups. Turns of one session can land on
+        different workers or instances, so the local copy may be missing a
+        turn saved elsewhere; saving it back would drop that turn.
+        """
+        now = datetime.now(_UTC)
+        if cached:
+            with self._cache_lock:
+                session = self._cache.get(session_id)
+            if session is not None and now - session.updated_at <= self._cache_freshness:
+                return session.model_copy(deep=True)
+        
         try:
             doc_ref = self.db.collection(self.collection_name).document(session_id)
             doc = doc_ref.get()
@@ -290,19 +394,31 @@ class FirestoreSessionStore:
             session = ConversationState.from_firestore_dict(data)
             
             # Check if session has expired
-            if datetime.now(timezone.utc) - session.updated_at > self.session_ttl:
+            if now - session.updated_at > self.session_ttl:
                 logger.info(f"Session expired: {session_id}")
                 self.delete_session(session_id)
                 return None
             
+            with self._cache_lock:
+                self._cache[session_id] = session.model_copy(deep=True)
             return session
             
         except Exception as e:
             logger.error(f"Error retrieving session {session_id}: {e}")
             return None
 
+    def document(self, session_id: str) -> "firestore.DocumentReference":
+        """Document reference for a session, e.g. to include it in a batch."""
+        return self.db.collection(self.collection_name).document(session_id)
+
+    def evict(self, session_id: str) -> None:
+        """Drop a session from the local cache (e.g. after deleting it in a batch)."""
+        with self._cache_lock:
+            self._cache.pop(session_id, None)
+
     def delete_session(self, session_id: str) -> None:
         """Delete a session from Firestore."""
+        self.evict(session_id)
         try:
             doc_ref = self.db.collection(self.collection_name).document(session_id)
             doc_ref.delete()
@@ -317,17 +433,22 @@ class FirestoreSessionStore:
         Note: For production, consider using Firestore TTL policies instead.
         """
         try:
-            cutoff = datetime.now(timezone.utc) - self.session_ttl
+            cutoff = datetime.now(_UTC) - self.session_ttl
             expired_query = (
                 self.db.collection(self.collection_name)
                 .where("updated_at", "<", cutoff)
-                .limit(100)  # Batch limit
+                .select(["updated_at"])  # Only the reference is needed, not the transcript
+                .limit(500)  # Batch limit
             )
             
+            # BulkWriter batches the deletes and commits them in parallel
+            bulk_writer = self.db.bulk_writer()
             deleted_count = 0
-            for doc in expired_query.stream():
-                doc.reference.delete()
+            # Bounded query: a single get() RPC is cheaper than a streamed iterator
+            for doc in expired_query.get():
+                bulk_writer.delete(doc.reference)
                 deleted_count += 1
+            bulk_writer.close()
             
             if deleted_count > 0:
                 logger.info(f"Cleaned up {deleted_count} expired sessions")
@@ -359,6 +480,7 @@ class OnboardingConversationHandler:
         project_id: str,
         location: str = "us-central1",
         firestore_collection: str = "users",
+        db: Optional["firestore.Client"] = None,
     ):
         """
         Initialize the onboarding handler.
@@ -367,20 +489,48 @@ class OnboardingConversationHandler:
             project_id: Google Cloud project ID
             location: Vertex AI region
             firestore_collection: Firestore collection name for user profiles
+            db: Shared Firestore client; one is created if not provided
         """
         self.project_id = project_id
         self.location = location
         self.firestore_collection = firestore_collection
         
-        # Initialize Vertex AI
+        # The Gemini model is built on first use (see ``model``) so Firestore-only
+        # paths such as get_user_profile don't pay for it on a cold start.
+        self._model = None
+        self._model_lock = threading.Lock()
+
+        if db is None:
+            # Vertex init and Firestore client creation are independent and both
+            # slow on a cold start; overlap them.
+            with ThreadPoolExecutor(max_workers=2) as ex:
+                f_vx = ex.submit(self._init_vertex)
+                f_fs = ex.submit(self._init_firestore, None)
+                f_vx.result()
+                f_fs.result()
+        else:
+            self._init_vertex()
+            self._init_firestore(db)
+
+        # Note: Sessions are now stored in Firestore via self.session_store
+
+        # Safety settings for the model
+        try:
+            from vertexai.generative_models import HarmCategory, HarmBlockThreshold
+            self._safety_settings = {
+                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
+            }
+        except ImportError:
+            self._safety_settings = {}
+
+    def _init_vertex(self) -> None:
+        """Initialize the Vertex AI SDK."""
         try:
             import vertexai
-            from vertexai.generative_models import GenerativeModel, HarmCategory, HarmBlockThreshold
-            vertexai.init(project=project_id, location=location)
-            self.model = GenerativeModel(
-                "gemini-2.0-flash-001",
-                system_instruction=SYSTEM_INSTRUCTION,
-            )
+            vertexai.init(project=self.project_id, location=self.location)
             logger.info("Vertex AI initialized successfully")
         except ImportError:
              logger.error("Vertex AI libraries not installed.")
@@ -390,10 +540,13 @@ class OnboardingConversationHandler:
             logger.error(f"Failed to initialize Vertex AI: {e}")
             raise
 
-        # Initialize Firestore
+    def _init_firestore(self, db: Optional["firestore.Client"]) -> None:
+        """Set up the Firestore client and session store."""
         try:
-            from google.cloud import firestore
-            self.db = firestore.Client(project=project_id)
+            if db is None:
+                from google.cloud import firestore
+                db = firestore.Client(project=self.project_id)
+            self.db = db
             self.session_store = FirestoreSessionStore(
                 db=self.db,
                 collection_name="onboarding_sessions",
@@ -408,32 +561,32 @@ class OnboardingConversationHandler:
             logger.error(f"Failed to initialize Firestore: {e}")
             raise
 
-        # Note: Sessions are now stored in Firestore via self.session_store
-
-        # Safety settings for the model
-        try:
-            from vertexai.generative_models import HarmCategory, HarmBlockThreshold
-            self._safety_settings = {
-                HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-                HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_ONLY_HIGH,
-            }
-        except ImportError:
-            self._safety_settings = {}
-
-    def start_conversation(self, location_data: dict) -> tuple[str, str]:
+    @property
+    def model(self) -> "GenerativeModel":
+        """Gemini model, constructed on first access."""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    from vertexai.generative_models import GenerativeModel
+                    self._model = GenerativeModel(
+                        "gemini-2.0-flash-001",
+                        system_instruction=SYSTEM_INSTRUCTION,
+                    )
+        return self._model
+
+    def start_conversation(self, location_data: dict | LocationData) -> tuple[str, str]:
         """
         Start a new onboarding conversation.
 
         Args:
-            location_data: Dictionary with 'city' and 'country' keys
+            location_data: Dictionary with 'city' and 'country' keys, or an
+                already validated LocationData (used as is)
 
         Returns:
             Tuple of (session_id, initial_message)
         """
         # Validate and parse location data
-        location = LocationData(**location_data)
+        location = _as_location(location_data)
         
         # Create new session
         session_id = str(uuid.uuid4())
@@ -444,15 +597,11 @@ class OnboardingConversationHandler:
         
         # Generate initial message using cold-start prompt
         try:
-            from vertexai.generative_models import GenerationConfig
             cold_start_prompt = get_cold_start_prompt(location)
             
             response = self.model.generate_content(
                 cold_start_prompt,
-                generation_config=GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=256,
-                ),
+                generation_config=CHAT_GENERATION_CONFIG,
                 safety_settings=self._safety_settings,
             )
             
@@ -485,38 +634,109 @@ class OnboardingConversationHandler:
         Returns:
             Tuple of (assistant_response, is_conversation_complete)
         """
-        # Get session from Firestore
-        session = self.session_store.get_session(session_id)
-        if not session:
-            raise ValueError(f"Session not found: {session_id}")
-        
+        session = self._load_session(session_id)
         if session.is_complete:
-            return "We've already collected your preferences. Thank you!", True
+            return ALREADY_COMPLETE_REPLY, True
         
-        # Add user message to history
-        session.messages.append(ChatMessage(role="user", content=user_message))
+        contents = self._prepare_turn(session, user_message)
+        try:
+            response = self.model.generate_content(
+                contents,
+                generation_config=CHAT_GENERATION_CONFIG,
+                safety_settings=self._safety_settings,
+            )
+            assistant_message = response.text.strip()
+        except Exception as e:
+            logger.error(f"Error generating response: {e}")
+            raise RuntimeError(f"Failed to generate response: {e}")
         
-        # Build conversation history for the model
-        contents = self._build_chat_history(session)
+        return assistant_message, self._record_reply(session, assistant_message)
+
+    async def send_message_async(self, session_id: str, user_message: str) -> tuple[str, bool]:
+        """
+        Async variant of send_message.
+
+        The Gemini call goes through generate_content_async, so concurrent
+        conversations share the model's channel on the event loop instead of
+        each holding a worker thread for the length of the RPC. Firestore
+        reads and writes still run in a thread.
+        """
+        session = await asyncio.to_thread(self._load_session, session_id)
+        if session.is_complete:
+            return ALREADY_COMPLETE_REPLY, True
         
+        contents = self._prepare_turn(session, user_message)
         try:
-            from vertexai.generative_models import GenerationConfig
-            # Generate response
-            response = self.model.generate_content(
+            response = await self.model.generate_content_async(
                 contents,
-                generation_config=GenerationConfig(
-                    temperature=0.7,
-                    max_output_tokens=256,
-                ),
+                generation_config=CHAT_GENERATION_CONFIG,
                 safety_settings=self._safety_settings,
             )
-            
             assistant_message = response.text.strip()
-            
         except Exception as e:
             logger.error(f"Error generating response: {e}")
             raise RuntimeError(f"Failed to generate response: {e}")
         
+        is_complete = await asyncio.to_thread(self._record_reply, session, assistant_message)
+        return assistant_message, is_complete
+
+    def send_message_stream(self, session_id: str, user_message: str) -> Iterator[dict]:
+        """
+        Streaming variant of send_message.
+
+        The session is looked up eagerly so a missing session raises
+        ValueError before any output is produced.
+
+        Returns:
+            Iterator of events: {"delta": text} for each chunk of the reply,
+            then {"done": True, "is_complete": bool} once the turn is saved,
+            or {"error": message} if generation fails part-way.
+        """
+        return self._stream_reply(self._load_session(session_id), user_message)
+
+    def _stream_reply(self, session: ConversationState, user_message: str) -> Iterator[dict]:
+        """Generate and persist one conversation turn, yielding reply chunks."""
+        if session.is_complete:
+            yield {"delta": ALREADY_COMPLETE_REPLY}
+            yield {"done": True, "is_complete": True}
+            return
+        
+        contents = self._prepare_turn(session, user_message)
+        chunks = []
+        try:
+            responses = self.model.generate_content(
+                contents,
+                generation_config=CHAT_GENERATION_CONFIG,
+                safety_settings=self._safety_settings,
+                stream=True,
+            )
+            for chunk in responses:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    yield {"delta": chunk.text}
+        except Exception as e:
+            logger.error(f"Error generating streamed response: {e}")
+            yield {"error": f"Failed to generate response: {e}"}
+            return
+        
+        is_complete = self._record_reply(session, "".join(chunks).strip())
+        yield {"done": True, "is_complete": is_complete}
+
+    def _load_session(self, session_id: str) -> ConversationState:
+        """Fetch a session for a new turn, raising ValueError if it doesn't exist."""
+        # Always read through to Firestore: the turn is saved back (see get_session)
+        session = self.session_store.get_session(session_id)
+        if not session:
+            raise ValueError(f"Session not found: {session_id}")
+        return session
+
+    def _prepare_turn(self, session: ConversationState, user_message: str) -> list["vertexai.generative_models.Content"]:
+        """Add the user's message to the session and build the model input."""
+        session.add_user_message(user_message)
+        return self._build_chat_history(session)
+
+    def _record_reply(self, session: ConversationState, assistant_message: str) -> bool:
+        """Append the assistant reply, update completion and save the session."""
         # Add assistant response to history
         session.messages.append(ChatMessage(role="assistant", content=assistant_message))
         
@@ -527,7 +747,7 @@ class OnboardingConversationHandler:
         # Save updated session to Firestore
         self.session_store.save_session(session)
         
-        return assistant_message, is_complete
+        return is_complete
 
     def _build_chat_history(self, session: ConversationState) -> list["vertexai.generative_models.Content"]:
         """Build Vertex AI Content objects from chat history."""
@@ -535,7 +755,7 @@ class OnboardingConversationHandler:
             from vertexai.generative_models import Content, Part
             contents = []
             
-            for msg in session.messages:
+            for msg in session.messages[-MAX_HISTORY_MESSAGES:]:
                 role = "user" if msg.role == "user" else "model"
                 contents.append(
                     Content(role=role, parts=[Part.from_text(msg.content)])
@@ -550,35 +770,25 @@ class OnboardingConversationHandler:
         
         Uses simple heuristics - in production, could use Gemini for smarter detection.
         """
-        # Count conversation turns (user messages)
-        user_messages = [m for m in session.messages if m.role == "user"]
+        turns = session.user_turn_count
+        if turns < 3:
+            return False
         
         # Check for completion phrases in the last assistant message
-        if session.messages:
-            last_message = session.messages[-1].content.lower()
-            completion_phrases = [
-                "all set",
-                "you're all set",
-                "that's everything",
-                "have everything i need",
-                "got everything",
-                "perfect!",
-                "thank you for sharing",
-            ]
-            if any(phrase in last_message for phrase in completion_phrases) and len(user_messages) >= 3:
-                return True
+        if session.messages and _COMPLETION_RE.search(session.messages[-1].content):
+            return True
         
         # Also complete after 4+ user turns as a fallback
-        return len(user_messages) >= 4
+        return turns >= 4
 
     def is_conversation_complete(self, session_id: str) -> bool:
         """Check if a conversation session is complete."""
-        session = self.session_store.get_session(session_id)
+        session = self.session_store.get_session(session_id, cached=True)
         return session.is_complete if session else False
 
     def get_chat_history(self, session_id: str) -> list[dict]:
         """Get the chat history for a session."""
-        session = self.session_store.get_session(session_id)
+        session = self.session_store.get_session(session_id, cached=True)
         if not session:
             raise ValueError(f"Session not found: {session_id}")
         
@@ -599,7 +809,7 @@ class OnboardingConversationHandler:
         Returns:
             The created UserProfile
         """
-        session = self.session_store.get_session(session_id)
+        session = await asyncio.to_thread(self.session_store.get_session, session_id)
         if not session:
             raise ValueError(f"Session not found: {session_id}")
         
@@ -615,7 +825,7 @@ class OnboardingConversationHandler:
         # Merge extracted preferences with location defaults
         dietary_prefs = extracted_data.get("dietary_preferences", [])
         if not dietary_prefs:
-            dietary_prefs = location_defaults
+            dietary_prefs = list(location_defaults)
         
         # Build the user profile
         profile = UserProfile(
@@ -630,11 +840,19 @@ class OnboardingConversationHandler:
             meal_schedule=WeeklySchedule(**extracted_data.get("meal_schedule", {})),
         )
         
-        # Save to Firestore
-        await self._save_to_firestore(profile)
-        
-        # Clean up session from Firestore
-        self.session_store.delete_session(session_id)
+        # Save the profile and delete the finished session in one atomic commit
+        batch = self.db.batch()
+        batch.set(
+            self.db.collection(self.firestore_collection).document(user_id),
+            profile.to_firestore_dict(),
+        )
+        batch.delete(self.session_store.document(session_id))
+        try:
+            await asyncio.to_thread(batch.commit)
+        except Exception as e:
+            logger.error(f"Error saving to Firestore: {type(e).__name__}: {e}")
+            raise RuntimeError(f"Failed to save profile to Firestore: {e}")
+        self.session_store.evict(session_id)
         
         logger.info(f"Created profile for user: {user_id}")
         return profile
@@ -653,11 +871,11 @@ class OnboardingConversationHandler:
         
         Uses JSON mode for reliable structured output.
         """
-        extraction_prompt = EXTRACTION_PROMPT.replace("{conversation}", conversation_text)
+        extraction_prompt = f"{_EXTRACTION_PREFIX}{conversation_text}{_EXTRACTION_SUFFIX}"
         
         try:
             from vertexai.generative_models import GenerationConfig
-            response = self.model.generate_content(
+            response = await self.model.generate_content_async(
                 extraction_prompt,
                 generation_config=GenerationConfig(
                     temperature=0.1,  # Low temperature for deterministic extraction
@@ -667,8 +885,7 @@ class OnboardingConversationHandler:
                 safety_settings=self._safety_settings,
             )
             
-            import json
-            extracted = json.loads(response.text)
+            extracted = orjson.loads(response.text)
             logger.info(f"Extracted profile data: {extracted}")
             return extracted
             
@@ -682,30 +899,6 @@ class OnboardingConversationHandler:
                 "meal_schedule": {},
             }
 
-    async def _save_to_firestore(self, profile: UserProfile) -> None:
-        """Save user profile to Firestore."""
-        logger.info(f"Attempting to save profile to Firestore: user_id={profile.user_id}, collection={self.firestore_collection}")
-        try:
-            profile_dict = profile.to_firestore_dict()
-            logger.info(f"Profile dict prepared: {profile_dict}")
-            
-            doc_ref = self.db.collection(self.firestore_collection).document(profile.user_id)
-            logger.info(f"Document reference created: {doc_ref.path}")
-            
-            doc_ref.set(profile_dict)
-            
-            # Verify the write
-            verify_doc = doc_ref.get()
-            if verify_doc.exists:
-                logger.info(f"Successfully saved and verified profile in Firestore: {profile.user_id}")
-            else:
-                logger.error(f"Write appeared to succeed but document not found: {profile.user_id}")
-                raise RuntimeError("Document write verification failed")
-                
-        except Exception as e:
-            logger.error(f"Error saving to Firestore: {type(e).__name__}: {e}")
-            raise RuntimeError(f"Failed to save profile to Firestore: {e}")
-
     async def get_user_profile(self, user_id: str) -> Optional[UserProfile]:
         """
         Retrieve a user profile from Firestore.
@@ -718,7 +911,7 @@ class OnboardingConversationHandler:
         """
         try:
             doc_ref = self.db.collection(self.firestore_collection).document(user_id)
-            doc = doc_ref.get()
+            doc = await asyncio.to_thread(doc_ref.get)
             
             if not doc.exists:
                 return None
@@ -731,7 +924,7 @@ class OnboardingConversationHandler:
                 dietary_preferences=data.get("dietary_preferences", []),
                 allergies_dislikes=data.get("allergies_dislikes", []),
                 meal_schedule=WeeklySchedule(**data.get("meal_schedule", {})),
-                created_at=data.get("created_at", datetime.now(timezone.utc)),
+                created_at=data.get("created_at") or datetime.now(_UTC),
             )
         except Exception as e:
             logger.error(f"Error retrieving profile: {e}")
@@ -752,9 +945,9 @@ class MockOnboardingConversationHandler:
         self.profiles = {}  # {user_id: UserProfile}
         print("MockOnboardingConversationHandler initialized")
 
-    def start_conversation(self, location_data: dict) -> tuple[str, str]:
+    def start_conversation(self, location_data: dict | LocationData) -> tuple[str, str]:
         session_id = str(uuid.uuid4())
-        location = LocationData(**location_data)
+        location = _as_location(location_data)
         
         session = ConversationState(
             session_id=session_id,
@@ -777,10 +970,10 @@ class MockOnboardingConversationHandler:
             raise ValueError(f"Session not found: {session_id}")
             
         session = self.sessions[session_id]
-        session.messages.append(ChatMessage(role="user", content=user_message))
+        session.add_user_message(user_message)
         
         # Simple finite state machine for mock conversation
-        user_msg_count = len([m for m in session.messages if m.role == "user"])
+        user_msg_count = session.user_turn_count
         
         if user_msg_count == 1:
             response = "Got it. Do you have any dietary restrictions or allergies?"
@@ -795,6 +988,13 @@ class MockOnboardingConversationHandler:
         session.messages.append(ChatMessage(role="assistant", content=response))
         return response, session.is_complete
 
+    async def send_message_async(self, session_id: str, user_message: str) -> tuple[str, bool]:
+        return self.send_message(session_id, user_message)
+
+    def send_message_stream(self, session_id: str, user_message: str) -> Iterator[dict]:
+        response, is_complete = self.send_message(session_id, user_message)
+        return iter([{"delta": response}, {"done": True, "is_complete": is_complete}])
+
     def get_chat_history(self, session_id: str) -> list[dict]:
         if session_id not in self.sessions:
             raise ValueError(f"Session not found: {session_id}")